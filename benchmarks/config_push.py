@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# config_push.py
+"""
+Copyright (c) 2015 ContinuumBridge Limited
+
+Airtime spent configuring a network, with one config frame per item compared with
+config_set frames.
+
+Nodes are included in galvanize_sim in slotted mode. At PUSH_AT the bridge is given a new
+configuration for all four messages (their lines, fonts and the revert flag), and at
+REPUSH_AT it is given the same configuration again, as happens when a fleet-wide push is
+repeated. For each push the table shows, by the end of the run or the next push:
+
+    current     nodes that have the configuration
+    frames      config or config_set frames sent by the bridge
+    acks        acks sent by nodes for them
+    bytes       bytes on air for both, including preambles
+    skipped     wakeups at which the bridge saw the node was already current
+    all_by      seconds from the push until every node was current
+
+    python benchmarks/config_push.py [nodes]
+"""
+
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import galvanize_sim
+import galvanize_config
+from galvanize_sim import PREAMBLE_BYTES
+
+PUSH_AT     = 300.0
+REPUSH_AT   = 900.0
+DURATION    = 1500.0
+ACK_BYTES   = PREAMBLE_BYTES + 6
+
+ITEMS = [galvanize_config.line(1, 1, "Press for service"), galvanize_config.line(1, 2, "Table 12"),
+         galvanize_config.line(2, 1, "Help is on its way"), galvanize_config.line(2, 2, "Press again to cancel"),
+         galvanize_config.line(3, 1, "Cancelled"), galvanize_config.line(4, 1, "Closed"),
+         galvanize_config.font(1, "medium", 2), galvanize_config.font(2, "medium", 2),
+         galvanize_config.font(3, "large", 1), galvanize_config.font(4, "large", 1),
+         galvanize_config.revert(True)]
+
+def target(node):
+    """ The node's display configuration, to compare with what ITEMS should give. """
+    return [node.displayMessage[m] for m in ("m1", "m2", "m3", "m4")] + \
+           [(node.displayFonts[m], node.numberLines[m]) for m in ("m1", "m2", "m3", "m4")]
+
+def run(count, bulk):
+    network = galvanize_sim.Network(count, slotted=True, pressInterval=1e9)
+    bridge = network.bridge
+    clock = network.clock
+    rows = []
+    expected = []
+    def push():
+        bridge.setConfig(ITEMS, bulk)
+        rows.append({"at": clock.now, "frames": bridge.configFrames, "bytes": bridge.configBytes,
+                     "acks": bridge.acks, "skipped": bridge.configSkipped, "all_by": None})
+    def check():
+        if rows and rows[-1]["all_by"] is None:
+            if all(target(node) == expected[0] for node in network.nodes):
+                rows[-1]["all_by"] = clock.now - rows[-1]["at"]
+        clock.callLater(1.0, check)
+    def finish(row):
+        row["current"] = sum(1 for node in network.nodes if target(node) == expected[0])
+        row["frames"] = bridge.configFrames - row["frames"]
+        row["acks"] = bridge.acks - row["acks"]
+        row["skipped"] = bridge.configSkipped - row["skipped"]
+        row["bytes"] = bridge.configBytes - row["bytes"] + row["frames"] * PREAMBLE_BYTES + row["acks"] * ACK_BYTES
+    reference = galvanize_sim.SimNode(network, 1)
+    reference.onConfigSet(memoryview(galvanize_config.encode(ITEMS, 1)[0]))
+    expected.append(target(reference))
+    clock.callLater(PUSH_AT, push)
+    clock.callLater(REPUSH_AT - 0.001, lambda: finish(rows[0]))
+    clock.callLater(REPUSH_AT, push)
+    clock.callLater(PUSH_AT, check)
+    network.run(DURATION)
+    finish(rows[1])
+    return rows
+
+def main(argv):
+    count = int(argv[1]) if len(argv) > 1 else 30
+    print("%6s %10s %6s %8s %7s %6s %8s %8s %7s" % ("nodes", "mode", "push", "current", "frames", "acks", "bytes",
+                                                  "skipped", "all_by"))
+    for bulk in (False, True):
+        for n, row in enumerate(run(count, bulk)):
+            print("%6d %10s %6d %8d %7d %6d %8d %8d %7s" % (count, "config_set" if bulk else "config", n + 1,
+                  row["current"], row["frames"], row["acks"], row["bytes"], row["skipped"],
+                  "-" if row["all_by"] is None else "%.0f" % row["all_by"]))
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# duty_cycle.py
+"""
+Copyright (c) 2015 ContinuumBridge Limited
+
+Radio duty cycle by phase, and time to get back on the network after the bridge goes
+off the air, with fixed and with adaptive (beacon aligned) search and wake timing.
+
+Each mode runs the same slotted galvanize_sim network. Once the nodes have settled, the
+bridge is off the air for outage seconds. The table shows, summed over all nodes, the
+time spent in each phase and the fraction of it with the radio on, then:
+
+    back        nodes acked or granted by the bridge again by the end of the run
+    back_p50/95 seconds from the end of the outage to the first ack or grant after it
+    radio_on    average seconds of radio on time per node over the whole run
+
+    python benchmarks/duty_cycle.py [nodes] [outage]
+"""
+
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import galvanize_sim
+from galvanize_metrics import PHASES
+from galvanize_sim import percentile
+
+OUTAGE_START    = 900.0
+DURATION        = 3600.0
+POLL            = 1.0       # Resolution of the back times
+
+def watch(network, outageEnd, back):
+    """ Records in back, for each node, when it is first acked or granted after the outage. """
+    for node in network.nodes:
+        if node.nodeID not in back and node.heardAt is not None and node.heardAt > outageEnd:
+            back[node.nodeID] = node.heardAt - outageEnd
+    network.clock.callLater(POLL, watch, network, outageEnd, back)
+
+def run(count, outage, adaptive):
+    network = galvanize_sim.Network(count, slotted=True, adaptive=adaptive)
+    outageEnd = OUTAGE_START + outage
+    network.bridge.outage(OUTAGE_START, outage)
+    back = {}
+    network.clock.callLater(outageEnd, watch, network, outageEnd, back)
+    network.run(DURATION)
+    phases = dict((name, [0.0, 0.0]) for name in PHASES)
+    radioOn = 0.0
+    for node in network.nodes:
+        for name, phase in node.metrics.dutyCycle(DURATION).items():
+            phases[name][0] += phase["time"]
+            phases[name][1] += phase["radio_on"]
+        radioOn += node.metrics.radioTime(DURATION)
+    return phases, back.values(), radioOn / count
+
+def main(argv):
+    count = int(argv[1]) if len(argv) > 1 else 30
+    outage = float(argv[2]) if len(argv) > 2 else 600.0
+    print("%9s %s %6s %9s %9s %9s" % ("mode", " ".join("%9s %6s" % (name, "duty") for name in PHASES),
+                                     "back", "back_p50", "back_p95", "radio_on"))
+    for adaptive in (False, True):
+        phases, back, radioOn = run(count, outage, adaptive)
+        columns = []
+        for name in PHASES:
+            time, on = phases[name]
+            columns.append("%9.0f %6.3f" % (time, on / time if time else 0.0))
+        print("%9s %s %6d %9.1f %9.1f %9.0f" % ("adaptive" if adaptive else "fixed", " ".join(columns),
+                                                len(back), percentile(back, 50), percentile(back, 95), radioOn))
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,394 @@
+#!/usr/bin/env python
+# hot_paths.py
+"""
+Copyright (c) 2015 ContinuumBridge Limited
+
+Microbenchmarks for the node's hot paths, with a regression check against stored baselines.
+
+galvanize_node_a.App is run on local stand-ins for the platform, so that nothing outside
+this repository is needed: cbcommslib.CbApp records what the app sends instead of talking
+to the bridge manager, cbconfig gives a temporary CB_CONFIG_DIR and twisted.internet.reactor
+is a StandinReactor, a VirtualClock. Each benchmark starts from a fresh app whose node has
+been included, and frames are delivered through App.onAdaptorData as the radio adaptor
+would deliver them:
+
+    rx_beacon           a beacon, with nothing to send
+    rx_grant            an include_grant for the node, which saves its state and queues an ack
+    rx_config           a config frame with one display line, which also saves and queues an ack
+    rx_ack              an alert queued with sendRadio and sent, then the ack for it
+    send_radio          sendRadio of an alert
+    queue_radio         queueRadio of an alert that has already been encoded
+    manage_send_deep    with DEEP_QUEUE messages queued, one send cycle: manageSend, the delayed
+                        send in the node's slot, the ack and a new message queued behind the rest
+    on_config           onConfig of one display line, without the frame around it
+    set_display         setDisplay, alternating between two screens
+
+Messages a benchmark queues are dropped after each operation, so the queue does not grow.
+Each timed run of about RUN_TIME seconds is followed by a run of calibrate(), a fixed loop
+of plain Python, so that the results can be compared across machines. The table shows,
+from the best of REPEATS runs of each:
+
+    ops_per_sec operations per second, which depends on the machine
+    relative    operations per calibrate() loop, which is what is compared and saved
+    objects     growth, per operation, in the objects tracked by the garbage collector over
+                LEAK_RUNS timed runs' worth of operations. This is zero unless it leaks; it
+                does not count the objects that are allocated and freed again
+    retained    bytes, as traced by tracemalloc or, on Python 2, from the growth of the
+                resident set (Linux only), which is only good to RETAINED_TOLERANCE bytes
+
+The node logs at CB_LOGGING_LEVEL, warning unless it is set.
+
+With no options the results are compared with benchmarks/hot_paths.json and the exit
+status is 1 if any benchmark has become more than threshold (a fraction, 0.25 by default)
+slower relative to calibrate(), or leaves more objects or memory behind than it did. A
+benchmark that looks slower is measured again, and only counts as a regression if all
+CONFIRM measurements are. --save stores the relative results, the best of CONFIRM
+measurements, as the new baselines. The ratios still vary somewhat between interpreters
+and processors, so the baselines say which Python they were saved with.
+
+    python benchmarks/hot_paths.py [--save] [--threshold fraction] [benchmark] [benchmark] ...
+"""
+
+import os
+import gc
+import sys
+import json
+import base64
+import timeit
+import shutil
+import tempfile
+import platform
+import types
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None      # Python 2: retained memory is measured from the resident set size
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import galvanize_frame
+import galvanize_config
+from galvanize_core import BEACON_ADDRESS, GRANT_ADDRESS
+from galvanize_drivers import VirtualClock
+from galvanize_host import GRANT_ID, GRANT_NEW_ADDRESS
+
+BASELINES           = os.path.join(os.path.dirname(os.path.abspath(__file__)), "hot_paths.json")
+THRESHOLD           = 0.25      # Fraction slower than the baseline that counts as a regression
+OBJECTS_TOLERANCE   = 0.05      # Objects per operation, to allow for one-off allocations
+RETAINED_TOLERANCE  = 64        # Bytes per operation, as the resident set grows in pages and arenas
+NUMBER              = 2000      # Operations for warming up
+LEAK_RUNS           = 5         # Timed runs' worth of operations to look for leaks over
+RUN_TIME            = 0.2       # Seconds each timed run should take, roughly
+REPEATS             = 7
+CONFIRM             = 3         # Measurements that must all be slower to count as a regression
+CALIBRATION         = 1000      # Iterations of the calibrate() loop
+DEEP_QUEUE          = 1000
+BRIDGE_ADDRESS      = 0x1000
+NODE_ADDRESS        = 0x0042
+PAGE_SIZE           = os.sysconf("SC_PAGE_SIZE")
+
+class StandinReactor(VirtualClock):
+    """
+    Twisted's reactor, as far as TwistedDriver uses it. Like Twisted, and unlike VirtualClock,
+    it drops cancelled calls once there are enough of them, so they do not build up while
+    virtual time stands still.
+    """
+    def __init__(self):
+        VirtualClock.__init__(self)
+        self.scheduled = 0
+
+    def callLater(self, delay, func, *args):
+        self.scheduled += 1
+        if self.scheduled > 50 and self.scheduled > len(self.calls) >> 1:
+            self.compact()
+        return VirtualClock.callLater(self, delay, func, *args)
+
+    def compact(self):
+        self.calls = [call for call in self.calls if not call.cancelled]
+        self.calls.sort()
+        self.scheduled = 0
+
+class StandinCbApp():
+    """ cbcommslib.CbApp. Keeps count of the messages sent instead of sending them. """
+    def __init__(self, argv):
+        self.id = argv[2] if len(argv) > 2 else "app_bench"
+        self.sent = 0
+        self.managerSent = 0
+
+    def sendMessage(self, msg, destination):
+        self.sent += 1
+
+    def sendManagerMessage(self, msg):
+        self.managerSent += 1
+
+    def cbLog(self, level, msg):
+        pass
+
+def installStandins(configDir):
+    """ Puts the stand-ins in sys.modules in place of the platform's modules. Returns the reactor. """
+    reactor = StandinReactor()
+    modules = {
+        "cbcommslib": {"CbApp": StandinCbApp},
+        "cbconfig": {"CB_CONFIG_DIR": configDir},
+        "twisted": {},
+        "twisted.internet": {"reactor": reactor}
+    }
+    for name, attributes in modules.items():
+        module = types.ModuleType(name)
+        module.__dict__.update(attributes)
+        sys.modules[name] = module
+    sys.modules["twisted"].internet = sys.modules["twisted.internet"]
+    sys.modules.pop("galvanize_node_a", None)
+    return reactor
+
+def adaptorData(frame):
+    return {"id": "lprs", "characteristic": "galvanize_button", "data": base64.b64encode(frame)}
+
+def downlink(function, data=None):
+    return adaptorData(galvanize_frame.encode(NODE_ADDRESS, BRIDGE_ADDRESS, function, data))
+
+def grant(node):
+    return adaptorData(galvanize_frame.encode(GRANT_ADDRESS, BRIDGE_ADDRESS, "include_grant",
+                       galvanize_frame.WAKEUP.pack(0) + GRANT_ID.pack(node.nodeID) + GRANT_NEW_ADDRESS.pack(NODE_ADDRESS)))
+
+BEACON = adaptorData(galvanize_frame.encode(BEACON_ADDRESS, BRIDGE_ADDRESS, "beacon"))
+LINE = galvanize_config.line(1, 2, "Bench line")
+CONFIG = downlink("config", galvanize_frame.WAKEUP.pack(0) + LINE)
+ACK = downlink("ack")
+
+def makeApp(configDir):
+    """ Returns an App whose node has been switched on and included, and the reactor it runs on. """
+    reactor = installStandins(configDir)
+    import galvanize_node_a
+    app = galvanize_node_a.App(["galvanize_node_a.py", "bench_socket", "app_bench"])
+    app.onConfigureMessage({})
+    app.onAdaptorService({"id": "lprs", "service": [{"characteristic": "galvanize_button"}]})
+    node = app.galvanize
+    node.matchGrant = True
+    node.onButtonPress(1, 0)
+    node.onButtonPress(0, node.intervals["t_start_press"] + 1)
+    app.onAdaptorData(BEACON)
+    app.onAdaptorData(grant(node))
+    node.radioQueue.clear()
+    return app, reactor
+
+def rxBeacon(app, reactor):
+    def op():
+        app.onAdaptorData(BEACON)
+    return op
+
+def rxGrant(app, reactor):
+    queue = app.galvanize.radioQueue
+    message = grant(app.galvanize)
+    def op():
+        app.onAdaptorData(message)
+        queue.clear()
+    return op
+
+def rxConfig(app, reactor):
+    queue = app.galvanize.radioQueue
+    def op():
+        app.onAdaptorData(CONFIG)
+        queue.clear()
+    return op
+
+def rxAck(app, reactor):
+    node = app.galvanize
+    def op():
+        node.sendRadio("alert", "\x00\x00")
+        node.delayedSend(node.radioQueue.head())
+        app.onAdaptorData(ACK)
+    return op
+
+def sendRadio(app, reactor):
+    node = app.galvanize
+    def op():
+        node.sendRadio("alert", "\x00\x00")
+        node.radioQueue.clear()
+    return op
+
+def queueRadio(app, reactor):
+    node = app.galvanize
+    msg = node.radioCommand(galvanize_frame.encode(BRIDGE_ADDRESS, NODE_ADDRESS, "alert", "\x00\x00"))
+    def op():
+        node.queueRadio(msg, "alert", "\x00\x00")
+        node.radioQueue.clear()
+    return op
+
+def manageSendDeep(app, reactor):
+    node = app.galvanize
+    node.slotted = True
+    msg = node.radioCommand(galvanize_frame.encode(BRIDGE_ADDRESS, NODE_ADDRESS, "alert", "\x00\x00"))
+    for n in range(DEEP_QUEUE):
+        node.queueRadio(msg, "alert", "\x00\x00")
+    def op():
+        node.manageSend()
+        reactor.advance(1)
+        node.acknowledged()
+        node.queueRadio(msg, "alert", "\x00\x00")
+    return op
+
+def onConfig(app, reactor):
+    node = app.galvanize
+    data = memoryview(LINE)
+    def op():
+        node.onConfig(data)
+    return op
+
+def setDisplay(app, reactor):
+    node = app.galvanize
+    screens = ["m1", "m2"]
+    def op():
+        screens.reverse()
+        node.setDisplay(screens[0])
+    return op
+
+BENCHMARKS = (
+    ("rx_beacon", rxBeacon),
+    ("rx_grant", rxGrant),
+    ("rx_config", rxConfig),
+    ("rx_ack", rxAck),
+    ("send_radio", sendRadio),
+    ("queue_radio", queueRadio),
+    ("manage_send_deep", manageSendDeep),
+    ("on_config", onConfig),
+    ("set_display", setDisplay)
+)
+
+def calibrate():
+    """ A fixed mix of the work the hot paths do: calls, attribute and dict lookups, slicing. """
+    counts = {"a": 0, "b": 0}
+    keys = ("a", "b")
+    data = "\x00\x01" * 16
+    total = 0
+    for n in range(CALIBRATION):
+        key = keys[n & 1]
+        counts[key] += 1
+        total += len(data[n & 7:16]) + len(str(n))
+    return total
+
+def memoryInUse():
+    """ Bytes in use, as traced by tracemalloc if it is tracing, otherwise the resident set size. """
+    if tracemalloc is not None and tracemalloc.is_tracing():
+        return tracemalloc.get_traced_memory()[0]
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * PAGE_SIZE
+
+def leftBehind(op, reactor, number):
+    """ Returns the objects and bytes left behind per call of op. """
+    if tracemalloc is not None:
+        tracemalloc.start()
+    reactor.compact()
+    gc.collect()
+    objects = len(gc.get_objects())
+    memory = memoryInUse()
+    for n in range(number):
+        op()
+    reactor.compact()
+    gc.collect()
+    objects = len(gc.get_objects()) - objects
+    memory = memoryInUse() - memory
+    if tracemalloc is not None:
+        tracemalloc.stop()
+    return max(0.0, float(objects) / number), max(0.0, float(memory) / number)
+
+def measure(setup, configDir):
+    app, reactor = makeApp(configDir)
+    op = setup(app, reactor)
+    for n in range(NUMBER):
+        op()        # Warm up, and make any one-off allocations
+    timer = timeit.Timer(op)
+    number = max(1, int(NUMBER * RUN_TIME / timer.timeit(NUMBER)))
+    calibration = timeit.Timer(calibrate)
+    calibrations = max(1, int(10 * RUN_TIME / calibration.timeit(10)))
+    objects, retained = leftBehind(op, reactor, LEAK_RUNS * number)
+    best = calibrationBest = None
+    for n in range(REPEATS):
+        reactor.compact()
+        elapsed = timer.timeit(number)
+        best = elapsed if best is None else min(best, elapsed)
+        elapsed = calibration.timeit(calibrations)
+        calibrationBest = elapsed if calibrationBest is None else min(calibrationBest, elapsed)
+    opsPerSec = number / best
+    return {"ops_per_sec": opsPerSec, "relative": opsPerSec * calibrationBest / calibrations,
+            "objects": objects, "retained": retained}
+
+def slower(result, baseline, threshold):
+    return result["relative"] < baseline["relative"] * (1 - threshold)
+
+def regressions(name, result, baseline, threshold):
+    problems = []
+    if slower(result, baseline, threshold):
+        problems.append("%s: %.3f ops per calibration loop, baseline %.3f" % (name, result["relative"],
+                                                                              baseline["relative"]))
+    if result["objects"] > baseline["objects"] + OBJECTS_TOLERANCE:
+        problems.append("%s: %.2f objects left behind per op, baseline %.2f" % (name, result["objects"],
+                                                                                 baseline["objects"]))
+    if result["retained"] > baseline["retained"] + RETAINED_TOLERANCE:
+        problems.append("%s: %.0f bytes retained per op, baseline %.0f" % (name, result["retained"], baseline["retained"]))
+    return problems
+
+def main(argv):
+    args = argv[1:]
+    save = "--save" in args
+    threshold = THRESHOLD
+    if "--threshold" in args:
+        i = args.index("--threshold")
+        threshold = float(args[i+1])
+        del args[i:i+2]
+    names = [a for a in args if a != "--save"]
+    unknown = set(names) - set(name for name, setup in BENCHMARKS)
+    if unknown:
+        print("unknown benchmarks: %s" % ", ".join(sorted(unknown)))
+        return 1
+    os.environ.setdefault("CB_LOGGING_LEVEL", "warning")
+    os.environ.pop("CB_GALVANIZE_TRACE", None)
+    baselines = {"python": None, "results": {}}
+    if os.path.exists(BASELINES):
+        with open(BASELINES) as f:
+            baselines = json.load(f)
+    if not save and baselines["python"] not in (None, platform.python_version()):
+        print("baselines are for python %s, this is %s" % (baselines["python"], platform.python_version()))
+    configDir = tempfile.mkdtemp()
+    results = {}
+    problems = []
+    print("%-18s %12s %9s %9s %9s %9s %9s" % ("benchmark", "ops_per_sec", "relative", "baseline", "change",
+                                              "objects", "retained"))
+    try:
+        for name, setup in BENCHMARKS:
+            if names and name not in names:
+                continue
+            result = measure(setup, configDir)
+            baseline = baselines["results"].get(name)
+            # Baselines are the best of CONFIRM measurements, and so are results that look slower
+            for n in range(CONFIRM - 1):
+                if not save and (baseline is None or not slower(result, baseline, threshold)):
+                    break
+                again = measure(setup, configDir)
+                if again["relative"] > result["relative"]:
+                    result = again
+            results[name] = result
+            if baseline is None or save:
+                print("%-18s %12.0f %9.3f %9s %9s %9.2f %9.1f" % (name, result["ops_per_sec"], result["relative"], "-",
+                                                                  "-", result["objects"], result["retained"]))
+                continue
+            change = result["relative"] / baseline["relative"] - 1
+            print("%-18s %12.0f %9.3f %9.3f %+8.1f%% %9.2f %9.1f" % (name, result["ops_per_sec"], result["relative"],
+                                                                     baseline["relative"], 100 * change,
+                                                                     result["objects"], result["retained"]))
+            problems.extend(regressions(name, result, baseline, threshold))
+    finally:
+        shutil.rmtree(configDir)
+    if save:
+        baselines["python"] = platform.python_version()
+        for name, result in results.items():
+            baselines["results"][name] = dict((key, result[key]) for key in ("relative", "objects", "retained"))
+        with open(BASELINES, "w") as f:
+            json.dump(baselines, f, indent=4, sort_keys=True)
+            f.write("\n")
+        print("saved baselines to %s" % BASELINES)
+        return 0
+    for problem in problems:
+        print("regression: %s" % problem)
+    return 1 if problems else 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
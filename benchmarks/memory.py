@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+# memory.py
+"""
+Copyright (c) 2015 ContinuumBridge Limited
+
+Memory used per node. Each count of nodes is created in a fresh interpreter, which
+reports how much its resident set grew, divided by the number of nodes. Nodes are made
+the way a NodeHost would make them, on one VirtualClock, and are left in initial state
+with the default display tables, which is where nearly all nodes sit until the bridge
+configures them. --included also includes every node and sets one display line.
+
+    python benchmarks/memory.py [--included] [nodes] [nodes] ...
+"""
+
+import os
+import sys
+import gc
+import struct
+import resource
+import subprocess
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def residentBytes():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * resource.getpagesize()
+
+def measure(count, included):
+    from galvanize_core import Galvanize
+    from galvanize_drivers import VirtualClock
+    from galvanize_host import Outbox
+    clock = VirtualClock()
+    outbox = Outbox(clock)
+    gc.collect()
+    before = residentBytes()
+    nodes = []
+    for nodeID in range(count):
+        node = Galvanize(clock, transport=outbox)
+        node.nodeID = nodeID
+        if included:
+            node.onIncludeGrant(memoryview(struct.pack("I", nodeID) + struct.pack(">H", nodeID & 0xFFF)))
+            node.onConfig(memoryview("\x11\x05Hello"))
+        nodes.append(node)
+    gc.collect()
+    return (residentBytes() - before) / float(count)
+
+def main(argv):
+    if argv[1:2] == ["--child"]:
+        print(measure(int(argv[2]), argv[3] == "1"))
+        return
+    included = "--included" in argv
+    counts = [int(a) for a in argv[1:] if a != "--included"] or [10000, 100000]
+    print("%9s %14s" % ("nodes", "bytes/node"))
+    for count in counts:
+        out = subprocess.check_output([sys.executable, os.path.abspath(__file__), "--child", str(count),
+                                       "1" if included else "0"])
+        print("%9d %14.0f" % (count, float(out)))
+
+if __name__ == '__main__':
+    main(sys.argv)
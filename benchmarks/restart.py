@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+# restart.py
+"""
+Copyright (c) 2015 ContinuumBridge Limited
+
+Time for a node to become operational after a restart, with and without a state snapshot.
+
+Each node count is run twice in galvanize_sim, with nodes restarting at random in the
+first minute. The first run starts with no snapshots, so every node has to be long
+pressed, search for the network and be included. The second run restarts the same nodes
+from the snapshots saved by the first. Times are virtual seconds from the restart:
+
+    normal      until the node is in normal state and can raise alerts
+    first_ack   until the node has heard an ack from the bridge
+
+    python benchmarks/restart.py [nodes] [nodes] ...
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import galvanize_sim
+from galvanize_sim import percentile
+
+DURATION = 600.0
+
+def run(count, stateDir):
+    network = galvanize_sim.Network(count, slotted=True, stateDir=stateDir)
+    network.run(DURATION)
+    normal = []
+    firstAck = []
+    for node in network.nodes:
+        operational = node.restoredAt if node.restoredAt is not None else node.includedAt
+        if operational is not None:
+            normal.append(operational - node.startedAt)
+        if node.firstAckAt is not None:
+            firstAck.append(node.firstAckAt - node.startedAt)
+    return normal, firstAck
+
+def main(argv):
+    counts = [int(a) for a in argv[1:]] or [1, 30]
+    print("%7s %9s %11s %11s %11s %14s %14s" % ("nodes", "start", "normal", "normal_p50", "normal_p95",
+                                                "first_ack_p50", "first_ack_p95"))
+    for count in counts:
+        stateDir = tempfile.mkdtemp()
+        try:
+            for start in ("cold", "restored"):
+                normal, firstAck = run(count, stateDir)
+                print("%7d %9s %11d %11.1f %11.1f %14.1f %14.1f" % (count, start, len(normal),
+                      percentile(normal, 50), percentile(normal, 95),
+                      percentile(firstAck, 50), percentile(firstAck, 95)))
+        finally:
+            shutil.rmtree(stateDir)
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+# search_backoff.py
+"""
+Copyright (c) 2015 ContinuumBridge Limited
+
+Runs a node that never finds a network for a day of virtual time on a VirtualClock, and
+reports how many search windows it opened, how long its radio was on, and how long the
+run took in real time.
+
+    python benchmarks/search_backoff.py [hours]
+"""
+
+import os
+import sys
+import time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from galvanize_core import Galvanize
+from galvanize_drivers import VirtualClock
+
+class NullTransport():
+    def cbLog(self, level, msg):
+        pass
+
+    def sendMessage(self, msg, destination):
+        pass
+
+    def sendManagerMessage(self, msg):
+        pass
+
+class SearchingNode(Galvanize):
+    windows = 0
+
+    def searchTimeout(self, attempt):
+        if attempt in (1, 3):
+            self.windows += 1
+        Galvanize.searchTimeout(self, attempt)
+
+def main(argv):
+    hours = float(argv[1]) if len(argv) > 1 else 24.0
+    clock = VirtualClock()
+    node = SearchingNode(clock, transport=NullTransport())
+    node.id = "bench"
+    start = time.time()
+    node.onButtonPress(1, 0)
+    node.onButtonPress(0, node.intervals["t_start_press"] + 1)
+    clock.run(hours * 3600)
+    wall = time.time() - start
+    radioTime = node.metrics.radioTime(clock.seconds())
+    print("virtual time:   %.0f s" % clock.seconds())
+    print("search windows: %d" % node.windows)
+    print("radio on:       %.0f s (%.1f%%)" % (radioTime, 100.0 * radioTime / clock.seconds()))
+    print("wall time:      %.1f ms" % (wall * 1000))
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# sharding.py
+"""
+Copyright (c) 2015 ContinuumBridge Limited
+
+Throughput of a ShardedHost against the number of shards (worker processes).
+
+The script plays an ideal bridge, with no collisions and no lost frames: it beacons
+every BEACON_INTERVAL, grants every include_req and acks everything else. Every node is
+switched on with a long press in the first minute and then raises and clears alerts at
+random. Frames and presses are handed to the shards in one batch per STEP of virtual
+time. Throughput is frames delivered to nodes (a beacon counts once per node) per second
+of real time.
+
+    python benchmarks/sharding.py [nodes] [shards] [shards] ...
+"""
+
+import os
+import sys
+import time
+import random
+import struct
+import multiprocessing
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import galvanize_frame
+from galvanize_core import BEACON_ADDRESS, GRANT_ADDRESS
+from galvanize_host import ShardedHost
+from galvanize_sim import BRIDGE_ADDRESS, BEACON_INTERVAL
+
+DURATION        = 300.0
+STEP            = 0.1
+START_SPREAD    = 60.0
+PRESS_INTERVAL  = 60.0
+
+def schedule(nodeIDs, seed=1):
+    """ Returns {step: [(nodeID, buttonState), ...]} for every press and release. """
+    rand = random.Random(seed)
+    presses = {}
+    def press(at, held, nodeID):
+        presses.setdefault(int(at / STEP), []).append((nodeID, 1))
+        presses.setdefault(int((at + held) / STEP) + 1, []).append((nodeID, 0))
+    for nodeID in nodeIDs:
+        press(rand.uniform(0, START_SPREAD), 4.0, nodeID)
+        at = START_SPREAD + rand.expovariate(1.0/PRESS_INTERVAL)
+        held = 0.2
+        while at < DURATION:
+            press(at, held, nodeID)
+            at += held + rand.expovariate(1.0/PRESS_INTERVAL)
+            held = 4.2 - held       # Alternately raise and clear
+    return presses
+
+def bridge(sent, addresses):
+    """ Returns the replies to the frames nodes sent. """
+    replies = []
+    for at, frame in sent:
+        destination, source, function, length, payload = galvanize_frame.decode_uplink(frame)
+        if function == "include_req":
+            nodeID = payload[0:4].tobytes()
+            address = addresses.setdefault(nodeID, len(addresses) + 1)
+            replies.append(galvanize_frame.encode(GRANT_ADDRESS, BRIDGE_ADDRESS, "include_grant",
+                           galvanize_frame.WAKEUP.pack(0) + nodeID + struct.pack(">H", address)))
+        elif function != "ack":
+            replies.append(galvanize_frame.encode(source, BRIDGE_ADDRESS, "ack"))
+    return replies
+
+def run(count, shards):
+    nodeIDs = range(1, count + 1)
+    presses = schedule(nodeIDs)
+    host = ShardedHost(nodeIDs, shards, options={"slotted": True})
+    beacon = galvanize_frame.encode(BEACON_ADDRESS, BRIDGE_ADDRESS, "beacon")
+    beaconEvery = int(round(BEACON_INTERVAL / STEP))
+    addresses = {}
+    frames = []
+    delivered = 0
+    uplink = 0
+    start = time.time()
+    for step in range(1, int(DURATION / STEP) + 1):
+        if step % beaconEvery == 0:
+            frames.append(beacon)
+        delivered += sum(count if galvanize_frame.destination(f) == BEACON_ADDRESS else 1 for f in frames)
+        sent = host.step(step * STEP, frames, presses.get(step, ()))
+        uplink += len(sent)
+        frames = bridge(sent, addresses)
+    wall = time.time() - start
+    states = host.states()
+    host.stop()
+    return wall, delivered, uplink, states
+
+def main(argv):
+    count = int(argv[1]) if len(argv) > 1 else 2000
+    shardCounts = [int(a) for a in argv[2:]] or sorted(set([1, 2, 4, multiprocessing.cpu_count()]))
+    print("%d cores, %d nodes, %.0f s virtual time" % (multiprocessing.cpu_count(), count, DURATION))
+    print("%7s %9s %11s %9s %11s %9s %8s" % ("shards", "wall_s", "delivered", "uplink", "frames/s", "speedup", "normal"))
+    base = None
+    for shards in shardCounts:
+        wall, delivered, uplink, states = run(count, shards)
+        rate = (delivered + uplink) / wall
+        base = base or rate
+        print("%7d %9.2f %11d %9d %11.0f %9.2f %8d" % (shards, wall, delivered, uplink, rate, rate / base,
+                                                         states.get("normal", 0) + states.get("pressed", 0)))
+
+if __name__ == '__main__':
+    main(sys.argv)
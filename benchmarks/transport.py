@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# transport.py
+"""
+Copyright (c) 2015 ContinuumBridge Limited
+
+Cost of carrying frames to and from the radio adaptor.
+
+The platform carries messages between apps and adaptors as JSON, so frames go over it
+base64 encoded. In-process transports (the simulator, NodeHost shards, trace replay) set
+Galvanize.binary and pass the frames themselves. For each frame the table shows:
+
+    b64_bytes   size of the frame base64 encoded, as sent over the platform
+    esc_bytes   size of the frame as a JSON string, had it been sent as latin-1 text
+                instead. Bytes below 0x20 and above 0x7e become \\u00XX escapes, which
+                is why frames are not sent as text
+    wire        ns per frame: radioCommand, json.dumps and json.loads of the message,
+                and the adaptor taking the frame out of it
+    rx_wire     ns per frame: json.loads of the adaptor's message, App.onAdaptorData's
+                base64 decode and Galvanize.onRadioMessage (the node drops the frame, as
+                it is not for it)
+    tx_raw      ns per frame: radioCommand and commandFrame with binary set
+    rx_raw      ns per frame: Galvanize.onRadioMessage with the frame itself
+
+    python benchmarks/transport.py [repeats]
+"""
+
+import os
+import sys
+import json
+import base64
+import timeit
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import galvanize_frame
+from galvanize_core import Galvanize, commandFrame
+from galvanize_drivers import VirtualClock
+from galvanize_host import Outbox
+
+FRAMES = [
+    ("ack", galvanize_frame.encode(0x1000, 0x0001, "ack")),
+    ("alert", galvanize_frame.encode(0x1000, 0x0001, "alert", "\x00\x00")),
+    ("config", galvanize_frame.encode(0x0002, 0x1000, "config", "\x00\x00\x11\x14" + "x" * 20)),
+    ("largest", galvanize_frame.encode(0x0002, 0x1000, "config", "\x00" * (galvanize_frame.MAX_FRAME_LENGTH - 8)))
+]
+
+def perFrame(func, repeats):
+    return min(timeit.repeat(func, number=repeats, repeat=3)) / repeats * 1e9
+
+def overWire(node, frame):
+    """ What the adaptor gets for a frame the node sends. """
+    return base64.b64decode(json.loads(json.dumps(node.radioCommand(frame)))["data"])
+
+def main(argv):
+    repeats = int(argv[1]) if len(argv) > 1 else 100000
+    node = Galvanize(VirtualClock(), transport=Outbox(VirtualClock()))
+    node.id = "bench"
+    node.radioOn = True
+    print("%8s %9s %9s %9s %9s %9s %9s %9s" % ("frame", "raw_bytes", "b64_bytes", "esc_bytes", "wire", "rx_wire", "tx_raw", "rx_raw"))
+    for name, frame in FRAMES:
+        node.binary = False
+        assert overWire(node, frame) == frame
+        message = json.dumps({"id": "lprs", "characteristic": "galvanize_button", "data": base64.b64encode(frame)})
+        results = [perFrame(lambda: overWire(node, frame), repeats),
+                   perFrame(lambda: node.onRadioMessage(base64.b64decode(json.loads(message)["data"])), repeats)]
+        node.binary = True
+        results.append(perFrame(lambda: commandFrame(node.radioCommand(frame)), repeats))
+        results.append(perFrame(lambda: node.onRadioMessage(frame), repeats))
+        sizes = (len(frame), len(base64.b64encode(frame)), len(json.dumps(frame.decode("latin-1"))) - 2)
+        print("%8s %9d %9d %9d %9.0f %9.0f %9.0f %9.0f" % ((name,) + sizes + tuple(results)))
+
+if __name__ == '__main__':
+    main(sys.argv)
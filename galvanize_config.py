@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# galvanize_config.py
+"""
+Copyright (c) 2015 ContinuumBridge Limited
+
+Bulk configuration
+------------------
+
+A config frame carries one configuration item. A config_set frame carries as many as
+fit, with the version of the configuration they belong to:
+
+    version (4 bytes) | flags (1 byte) | item | item | ...
+
+Items have the same layout as the data of a config frame (see Galvanize.applyConfig):
+
+    line        screen << 4 | line (1 byte) | length (1 byte) | text     screens 1-4, lines 1-3
+    font        0xF0 | screen (1 byte) | font << 4 | number of lines (1 byte)
+    revert      0xB0 (1 byte) | 0 or 1 (1 byte)
+    show        0xD0 (1 byte) | screen (1 byte)
+
+A set with FULL set puts the node back to the default configuration before applying its
+items; without FULL the items are applied on top of what the node has. A set that does
+not fit in one frame is split, with MORE set on all but the last frame and the frame's
+index in the top four bits of flags. The node only takes on the version once it has
+had every frame of the set, in order.
+
+Each item is a complete setting, identified by its first byte. delta() gives the items
+a node needs to get from one configuration to another without FULL. There is no item
+that puts a single setting back to its default, so a target that drops a setting the
+node has can only be sent as a FULL set, and delta() raises ValueError for it.
+
+The version is a hash of all the items of the configuration, not just the ones in a
+delta. The node saves it with its state and sends it in every woken_up, so a bridge can
+tell which nodes already have the configuration it wants them to have and skip them.
+Version 0 means the configuration is not known, which is the case for a node that has
+never had a config_set or has had a single config frame since.
+"""
+
+import zlib
+import struct
+from galvanize_frame import HEADER_LENGTH, MAX_FRAME_LENGTH, WAKEUP
+
+SET_HEADER      = struct.Struct(">IB")
+VERSION         = struct.Struct(">I")
+ITEM            = struct.Struct("BB")
+FULL            = 0x01
+MORE            = 0x02
+INDEX_SHIFT     = 4
+UNKNOWN         = 0
+FONTS           = {"small": 1, "medium": 2, "large": 3}
+MAX_ITEMS_DATA  = MAX_FRAME_LENGTH - HEADER_LENGTH - WAKEUP.size - SET_HEADER.size
+
+def line(screen, line, text):
+    """ screen is 1 to 4 (m1 to m4), line 1 to 3. """
+    text = text[:MAX_ITEMS_DATA - ITEM.size]
+    return ITEM.pack(screen << 4 | line, len(text)) + text
+
+def font(screen, font, numberLines):
+    return ITEM.pack(0xF0 | screen, FONTS[font] << 4 | numberLines)
+
+def revert(on):
+    return ITEM.pack(0xB0, 1 if on else 0)
+
+def show(screen):
+    return ITEM.pack(0xD0, screen)
+
+def version(items):
+    """ The version of the configuration made up of items. Never UNKNOWN. """
+    return (zlib.crc32("".join(items)) & 0xFFFFFFFF) or 1
+
+def delta(current, target):
+    """
+    The items of target that are not in current, to be sent without FULL. Raises ValueError
+    if target has no item for a setting in current, as only a FULL set can remove it.
+    """
+    settings = set(item[0] for item in target)
+    for item in current:
+        if item[0] not in settings:
+            raise ValueError("setting %#04x is removed, which needs a FULL config_set" % ord(item[0]))
+    current = set(current)
+    return [item for item in target if item not in current]
+
+def encode(items, configVersion, full=True):
+    """ Returns the config_set payloads, each of which fits in one frame, that carry items. """
+    payloads = []
+    data = ""
+    for item in items:
+        if len(data) + len(item) > MAX_ITEMS_DATA:
+            payloads.append(data)
+            data = ""
+        data += item
+    payloads.append(data)
+    frames = []
+    for n, data in enumerate(payloads):
+        flags = (FULL if full and n == 0 else 0) | (MORE if n < len(payloads) - 1 else 0) | n << INDEX_SHIFT
+        frames.append(SET_HEADER.pack(configVersion, flags) + data)
+    return frames
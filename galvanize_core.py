@@ -0,0 +1,930 @@
+#!/usr/bin/env python
+# galvanize_core.py
+"""
+Copyright (c) 2015 ContinuumBridge Limited
+
+General notes for embedded implementation
+-----------------------------------------
+
+This module holds the node logic. It does not depend on the cbridge platform: the App
+class in galvanize_node_a.py connects it to the LPRS radio and to the server application,
+and galvanize_sim.py connects it to a simulated bridge. All of that can be ignored when it
+comes to translating this to an embedded implementation.
+
+Note that this code only implements the button node functions, not the sensor node, and in
+this version does not include encryption.
+
+The starting methods are onButtonPress and onRadioMessage, as nothing happens unless the
+button is pressed or a message arrives from the radio. They turn what happened into an
+event for dispatch(), which changes nodeState and calls an action as TRANSITIONS says.
+The actions call other methods, which are potentially delayed. Calls of the form:
+
+self.timers.start(NAME, DELAY, METHOD)
+
+cause METHOD to be called after DELAY seconds, replacing any timer already running under
+NAME. See galvanize_timers. Timers, and anything else to do with time, go through
+self.driver, a TwistedDriver unless another driver is passed to Galvanize().
+See galvanize_drivers.
+"""
+
+import os
+import base64
+import struct
+import random
+import galvanize_frame
+import galvanize_send
+import galvanize_drivers
+import galvanize_timers
+import galvanize_metrics
+import galvanize_display
+import galvanize_state
+import galvanize_machine
+import galvanize_config
+from galvanize_machine import ANY, SAME
+
+BEACON_ADDRESS      = 0xBBBB
+GRANT_ADDRESS       = 0xBB00
+NODE_ID             = 47
+SLOT_TIME           = 80        # The length of a data sending slot
+MAX_SLOTS           = 36        # The number of slots in a frame
+METRICS_INTERVAL    = 600       # Seconds between exports of metrics to the manager
+TDMA_SLOTS          = 32        # Slots assigned to included nodes. The rest are for contention
+BEACON_GUARD        = 0.2       # Seconds to listen either side of a predicted beacon
+MAX_BEACON_PERIOD   = 30        # Longer gaps between beacons are not taken as the beacon period
+GRANT_LENGTH        = 6         # ID bytes from the include_req (4), new address (2)
+LOG_LEVELS = {
+    "debug": 10,
+    "info": 20,
+    "warning": 30,
+    "error": 40,
+    "critical": 50
+}
+ALERTS = {
+    "pressed": struct.pack(">H", 0x0000),
+    "cleared": struct.pack(">H", 0x0100),
+    "battery": struct.pack(">H", 0x0200)
+}
+FONT_INDEX = {
+    1: "small",
+    2: "medium",
+    3: "large"
+}
+DISPLAY_INDEX = {
+    1: "m1",
+    2: "m2",
+    3: "m3",
+    4: "m4"
+}
+
+# Node states
+INITIAL             = 0
+SEARCH              = 1
+INCLUDE_REQ         = 2
+NORMAL              = 3
+PRESSED             = 4
+REVERTING           = 5
+STATE_NAMES         = ("initial", "search", "include_req", "normal", "pressed", "reverting")
+INCLUDED_STATES     = (NORMAL, PRESSED, REVERTING)  # States in which the node's state is worth saving
+
+# Node events
+RELEASE_SHORT       = 0     # Button released after up to t_long_press
+RELEASE_LONG        = 1     # Button released after more than t_long_press
+RELEASE_RESET       = 2     # Button released after more than t_reset_press
+BEACON              = 3     # Beacon received. Actions are passed the bridge address
+GRANT               = 4     # Our include_grant received
+REVERT_DONE         = 5     # The cancelling message has been shown for long enough
+COMMS_LOST          = 6     # Nothing heard for t_search_max with the radio on
+RELEASE_START       = 7     # Button released after more than t_start_press, in initial state
+EVENT_NAMES         = ("release_short", "release_long", "release_reset", "beacon", "grant", "revert_done",
+                       "comms_lost", "release_start")
+
+# The node state machine. See galvanize_machine
+TRANSITIONS = [
+    # state         event           action              next state
+    (ANY,           RELEASE_SHORT,  None,               SAME),
+    (ANY,           RELEASE_LONG,   None,               SAME),
+    (ANY,           RELEASE_RESET,  "reset",            INITIAL),
+    (ANY,           BEACON,         None,               SAME),
+    (ANY,           GRANT,          "included",         NORMAL),
+    (ANY,           REVERT_DONE,    None,               SAME),
+    (ANY,           COMMS_LOST,     "commsLost",        SEARCH),
+    (ANY,           RELEASE_START,  None,               SAME),
+    (INITIAL,       RELEASE_START,  "startSearch",      SEARCH),
+    (SEARCH,        BEACON,         "requestInclusion", INCLUDE_REQ),
+    (INCLUDE_REQ,   BEACON,         "retryInclusion",   INCLUDE_REQ),
+    (NORMAL,        RELEASE_SHORT,  "raiseAlert",       PRESSED),
+    (NORMAL,        RELEASE_LONG,   "raiseAlert",       PRESSED),
+    (PRESSED,       RELEASE_LONG,   "clearAlert",       REVERTING),
+    (REVERTING,     REVERT_DONE,    "showReady",        NORMAL)
+]
+MACHINE = galvanize_machine.Machine(TRANSITIONS, STATE_NAMES, EVENT_NAMES, INITIAL)
+
+# The duty cycle profiler phase of each state, while the radio is on
+STATE_PHASES = (galvanize_metrics.SEARCH, galvanize_metrics.SEARCH, galvanize_metrics.INCLUDE,
+                galvanize_metrics.NORMAL, galvanize_metrics.NORMAL, galvanize_metrics.NORMAL)
+
+# Defaults shared by every node until it changes them. See Galvanize.writable
+INTERVALS = {
+    "ts5": 30,
+    "tr1": 360,
+    "tr2": 3600,
+    "t_long_press": 3,
+    "t_reset_press": 8,
+    "t_start_press": 3,
+    "t_search_max": 30,
+    "t_short_search_wait": 120,
+    "t_long_search_wait": 180,
+    "t_min_search_wait": 5,     # Waits between search windows in adaptive mode double from this
+    "t_max_search_wait": 50,    # to this
+    "t_keep_awake": 20,
+    "t_sleep": 60
+}
+
+DISPLAY_MESSAGES = {
+    "m1": ("Push here", "to call for service", ""),
+    "m2": ("Your request has been sent", "", ""),
+    "m3": ("Cancelling request", "", ""),
+    "m4": ("", "", ""),
+    "initial": ("Push here for", "3 seconds to connect", "to network"),
+    "search": ("Searching for network", "", ""),
+    "connecting": ("Trying to connect to network", "Please wait", ""),
+    "commsProblem": ("Communication problem", "Button not in use", "")
+}
+
+DISPLAY_FONTS = {
+    "m1": "medium",
+    "m2": "medium",
+    "m3": "large",
+    "m4": "small",
+    "initial": "medium",
+    "search": "medium",
+    "connecting": "medium",
+    "commsProblem": "medium"
+}
+
+NUMBER_LINES = {
+    "m1": 2,
+    "m2": 1,
+    "m3": 1,
+    "m4": 0,
+    "initial": 3,
+    "search": 1,
+    "connecting": 2,
+    "commsProblem": 2
+}
+
+DEFAULTS = {
+    "intervals": INTERVALS,
+    "displayMessage": DISPLAY_MESSAGES,
+    "displayFonts": DISPLAY_FONTS,
+    "numberLines": NUMBER_LINES
+}
+DEFAULT_FRAMES = {}                 # Display frames of the default tables, shared like them
+galvanize_display.Display(DISPLAY_MESSAGES, DISPLAY_FONTS, NUMBER_LINES, DEFAULT_FRAMES).prerender()
+RADIO_COUNTERS = {
+    "sent": 0,
+    "retries": 0,
+    "slotted": 0,
+    "contention": 0,
+    "acked": 0,
+    "aggregated": 0,
+    "given_up": 0,
+    "dropped": 0,
+    "comms_problem": 0
+}
+
+def commandFrame(msg):
+    """ Returns the frame in a message made by Galvanize.radioCommand. """
+    frame = msg.get("frame")
+    if frame is None:
+        return base64.b64decode(msg["data"])
+    return frame
+
+class Galvanize(object):
+    __slots__ = ("driver", "timers", "cbLog", "sendMessage", "sendManagerMessage", "id",
+                 "intervals", "displayMessage", "displayFonts", "numberLines", "display",
+                 "radioQueue", "retryPolicies", "beaconDelay", "slotted", "aggregate", "batch",
+                 "radioCounters", "buttonPressTime", "currentDisplay", "nodeState", "nodeID",
+                 "nodeAddress", "bridgeAddress", "lprsID", "binary", "revertMessage", "radioOn", "tWait",
+                 "statePath", "metrics", "logLevel", "trace", "configVersion", "configPending",
+                 "adaptive", "beaconAt", "beaconPeriod", "searchWait", "matchGrant",
+                 "inclusionRetried")
+
+    def __init__(self, driver=None, timerService=None, transport=None):
+        """
+        driver is a galvanize_drivers driver, TwistedDriver by default. timerService defaults
+        to one driver call per timer. transport, if given, provides cbLog,
+        sendMessage and sendManagerMessage; otherwise they must be set on the node.
+        """
+        if driver is None:
+            driver = galvanize_drivers.TwistedDriver()
+        self.driver = driver
+        if timerService is None:
+            timerService = galvanize_timers.ReactorTimerService(driver)
+        self.timers = galvanize_timers.NodeTimers(timerService)
+        if transport is not None:
+            self.cbLog = transport.cbLog
+            self.sendMessage = transport.sendMessage
+            self.sendManagerMessage = transport.sendManagerMessage
+        self.intervals              = INTERVALS
+        self.displayMessage         = DISPLAY_MESSAGES
+        self.displayFonts           = DISPLAY_FONTS
+        self.numberLines            = NUMBER_LINES
+        self.radioQueue             = galvanize_send.SendQueue()
+        self.retryPolicies          = galvanize_send.RETRY_POLICIES
+        self.beaconDelay            = 32*0.08
+        self.slotted                = False     # Send in our own tWait slot once included
+        self.aggregate              = False     # Send everything queued in one aggregate frame
+        self.batch                  = ()        # Messages in the last frame sent, awaiting ack
+        self.radioCounters          = RADIO_COUNTERS   # Copied on the first queueRadio or commsLost
+        self.buttonPressTime        = 0
+        self.currentDisplay         = "m1"
+        self.display                = galvanize_display.Display(self.displayMessage, self.displayFonts,
+                                                                self.numberLines, DEFAULT_FRAMES)
+        self.nodeState              = INITIAL
+        self.nodeID                 = NODE_ID
+        self.nodeAddress            = 0xFFFF
+        self.bridgeAddress          = None
+        self.lprsID                 = None
+        self.binary                 = False     # sendMessage takes raw frames. See radioCommand
+        self.revertMessage          = True
+        self.configVersion          = galvanize_config.UNKNOWN     # See galvanize_config
+        self.configPending          = None      # The config_set we are part way through
+        self.radioOn                = False
+        self.tWait                  = None      # Our TDMA slot, once included
+        self.statePath              = None      # Where to save a snapshot of our state. See galvanize_state
+        self.metrics                = galvanize_metrics.NodeMetrics(driver.seconds())
+        self.logLevel               = LOG_LEVELS["debug"]
+        self.trace                  = None      # A galvanize_trace.TraceWriter while tracing
+        self.adaptive               = False     # Time search windows and wakeups from the beacons heard. See searchDelay
+        self.beaconAt               = None      # When the last beacon was heard
+        self.beaconPeriod           = None      # The beacon period, as measured
+        self.searchWait             = None      # The next wait between adaptive search windows
+        self.matchGrant             = False     # Only take grants that echo our ID. See onIncludeGrant
+        self.inclusionRetried       = False     # include_retry has been queued since the last include_req
+
+    def setLogLevel(self, level):
+        self.logLevel = LOG_LEVELS.get(str(level).lower(), LOG_LEVELS["debug"])
+
+    def writable(self, name):
+        """
+        Returns the node's own copy of the table name (intervals, displayMessage, displayFonts
+        or numberLines), copying the shared default the first time. Every change to one of
+        these tables must go through here.
+        """
+        table = getattr(self, name)
+        if table is DEFAULTS[name]:
+            table = dict(table)
+            setattr(self, name, table)
+            self.display.tables(self.displayMessage, self.displayFonts, self.numberLines)
+        return table
+
+    def logEnabled(self, level):
+        return LOG_LEVELS[level] >= self.logLevel
+
+    def log(self, level, msg, *args):
+        """
+        Level-gated logging. msg is only formatted (msg % args) if level is enabled, and any
+        callable in args is only called then, so expensive arguments can be passed as lambdas.
+        Calls on the radio hot paths are also wrapped in "if __debug__:", so running with
+        python -O (production mode) compiles the debug formatting out completely.
+        """
+        if LOG_LEVELS[level] >= self.logLevel:
+            if args:
+                msg = msg % tuple(a() if callable(a) else a for a in args)
+            self.cbLog(level, msg)
+
+    def setDisplay(self, index):
+        """ Only what differs from the screen currently shown is pushed to the display. """
+        self.currentDisplay = index
+        changes = self.display.show(index)
+        if not changes or not self.logEnabled("info"):
+            return
+        for position, value in changes:
+            if position == 0:
+                self.log("info", "Display font: %s", value)
+            else:
+                self.log("info", "Display line %d: %s", position, value)
+
+    def startTrace(self, writer):
+        """ Records everything the node is given and sends with writer. See galvanize_trace. """
+        self.trace = writer
+        writer.start(self.driver.seconds(), self)
+
+    def stopTrace(self):
+        """ Writes out what the trace writer holds and closes it. """
+        if self.trace is not None:
+            self.trace.close()
+            self.trace = None
+
+    def onButtonPress(self, buttonState, timeStamp):
+        if self.trace is not None:
+            self.trace.button(self.driver.seconds(), buttonState, timeStamp)
+        if buttonState == 1:
+            self.buttonPressTime = timeStamp
+        elif buttonState == 0:
+            pressedTime = timeStamp - self.buttonPressTime
+            if pressedTime > self.intervals["t_reset_press"]:
+                self.dispatch(RELEASE_RESET)
+            elif self.nodeState == INITIAL:
+                # Until the node is started, presses are only measured against t_start_press
+                self.dispatch(RELEASE_START if pressedTime > self.intervals["t_start_press"] else RELEASE_SHORT)
+            elif pressedTime > self.intervals["t_long_press"]:
+                self.dispatch(RELEASE_LONG)
+            else:
+                self.dispatch(RELEASE_SHORT)
+            self.log("debug", "onButtonPress, end state: %s", STATE_NAMES[self.nodeState])
+
+    def dispatch(self, event, *args):
+        """ Handles event in the current state. See TRANSITIONS. """
+        MACHINE.dispatch(self, event, *args)
+        self.profile()
+
+    def profile(self):
+        """ Tells the duty cycle profiler which phase the node is in. """
+        phase = STATE_PHASES[self.nodeState]
+        if phase == galvanize_metrics.NORMAL and not self.radioOn:
+            phase = galvanize_metrics.SLEEPING
+        self.metrics.enter(phase, self.driver.seconds())
+
+    def reset(self):
+        """ Forgets the bridge, so that nothing brings the node back as it was until it is included again. """
+        self.timers.cancel("wakeup")
+        self.timers.cancel("search")
+        self.radioQueue.clear()
+        self.setRadio(False)
+        self.nodeAddress = 0xFFFF
+        self.bridgeAddress = None
+        self.tWait = None
+        self.forgetState()
+        self.setDisplay("initial")
+
+    def startSearch(self):
+        self.setDisplay("search")
+        self.switchRadio(True)
+
+    def requestInclusion(self, bridgeAddress):
+        self.bridgeAddress = bridgeAddress
+        self.inclusionRetried = False
+        self.sendRadio("include_req", struct.pack("I", self.nodeID))
+        self.setDisplay("connecting")
+
+    def retryInclusion(self, bridgeAddress):
+        """
+        include_req is only sent once, so ask again, with the include_retry policy, if it has
+        gone without a grant. Once that has been given up on too, go back to searching.
+        """
+        for entry in self.radioQueue:
+            if entry["function"] == "include_req":
+                return
+        if self.inclusionRetried:
+            self.dispatch(COMMS_LOST)
+            return
+        self.inclusionRetried = True
+        self.sendRadio("include_req", struct.pack("I", self.nodeID), "include_retry")
+
+    def included(self):
+        # include_retry waits for an ack that never comes, so the grant ends it
+        for entry in [e for e in self.radioQueue if e["policy"] == "include_retry"]:
+            self.radioQueue.discard(entry)
+        self.saveState()
+        self.setDisplay("m1")
+        self.sendRadio("ack")
+
+    def raiseAlert(self):
+        self.setDisplay("m2")
+        self.sendRadio("alert", ALERTS["pressed"])
+
+    def clearAlert(self):
+        self.sendRadio("alert", ALERTS["cleared"])
+        if self.revertMessage:
+            self.setDisplay("m3")
+            self.timers.start("revert", 5, self.endRevert)
+        else:
+            self.dispatch(REVERT_DONE)
+
+    def endRevert(self):
+        self.dispatch(REVERT_DONE)
+
+    def showReady(self):
+        self.setDisplay("m1")
+
+    def commsLost(self):
+        self.setRadio(False)
+        self.setDisplay("commsProblem")
+        if self.radioCounters is RADIO_COUNTERS:
+            self.radioCounters = dict(RADIO_COUNTERS)
+        self.radioCounters["comms_problem"] += 1
+        self.radioCounters["dropped"] += len(self.radioQueue)
+        self.radioQueue.clear()  # Delete any messages in queue
+        self.searchWait = self.intervals["t_min_search_wait"]
+        self.timers.start("search", self.searchDelay(self.intervals["t_short_search_wait"]), self.searchTimeout, 1)
+
+    def searchTimeout(self, attempt):
+        """
+        Implements most of the beacon search process state machine
+        This function is called with attempt=0 if a beacon message has not been found after 30s of searching.
+        It then goes through a process of searching again after 10 mins and then after every hour. 
+        This goes on forever until a beacon is found or the node is reset.
+        Note that the search timer is cancelled if a message is received & hence this function is not called.
+        In adaptive mode the windows and the waits between them come from searchWindow and searchDelay.
+        """
+        self.log("info", "searchTimeout, attempt: %s", attempt)
+        if attempt == 0:
+            self.dispatch(COMMS_LOST)
+        elif attempt == 1:
+            self.setRadio(True)
+            self.timers.start("search", self.searchWindow(), self.searchTimeout, 2)
+        elif attempt == 2:
+            self.setRadio(False)
+            self.timers.start("search", self.searchDelay(self.intervals["t_long_search_wait"]), self.searchTimeout, 3)
+        elif attempt == 3:
+            self.setRadio(True)
+            self.timers.start("search", self.searchWindow(), self.searchTimeout, 2)
+
+    def onBeacon(self):
+        """ Measures the beacon period, allowing for beacons that were missed. """
+        now = self.driver.seconds()
+        if self.beaconAt is not None:
+            gap = now - self.beaconAt
+            if self.beaconPeriod is None:
+                if 0 < gap < MAX_BEACON_PERIOD:
+                    self.beaconPeriod = gap
+            else:
+                missed = int(round(gap / self.beaconPeriod))
+                if missed:
+                    self.beaconPeriod += (gap / missed - self.beaconPeriod) / 8
+        self.beaconAt = now
+
+    def nextBeacon(self, after):
+        """ The predicted time of the first beacon after after, or None if there is no prediction. """
+        if self.beaconPeriod is None:
+            return None
+        periods = int((after - self.beaconAt) / self.beaconPeriod) + 1
+        return self.beaconAt + periods * self.beaconPeriod
+
+    def searchWindow(self):
+        """ How long to listen for. One beacon period is enough if we know it. """
+        if self.adaptive and self.beaconPeriod is not None:
+            return self.beaconPeriod + 2 * BEACON_GUARD
+        return self.intervals["t_search_max"]
+
+    def searchDelay(self, wait):
+        """
+        How long to wait before the next search window. In adaptive mode the windows are only
+        one beacon period long and open just before a predicted beacon, so they can be much
+        more frequent for less radio on time: the waits double from t_min_search_wait up to
+        t_max_search_wait. Until a beacon period has been measured the fixed waits are used.
+        After outages of a few minutes or more adaptive nodes are back sooner, for less radio
+        on time. After outages of two minutes or so, which fixed nodes mostly sleep through,
+        they search more, and with 100 nodes the last of them are back later after long
+        outages, as their requests collide. So adaptive is off unless set.
+        See benchmarks/duty_cycle.py.
+        """
+        if not self.adaptive or self.beaconPeriod is None:
+            return wait
+        wait = self.searchWait
+        self.searchWait = min(2 * wait, self.intervals["t_max_search_wait"])
+        return self.sleepUntilBeacon(wait)
+
+    def sleepUntilBeacon(self, wait):
+        """ Stretches wait so that it ends just before a predicted beacon. """
+        now = self.driver.seconds()
+        beacon = self.nextBeacon(now + wait + BEACON_GUARD)
+        if beacon is None:
+            return wait
+        return beacon - BEACON_GUARD - now
+
+    def setRadio(self, on):
+        self.radioOn = on
+        self.metrics.radio(on, self.driver.seconds())
+        self.profile()
+
+    def switchRadio(self, state):
+        self.timers.cancel("search")  # Stops search timeout when we switch radion on or off
+        if state == False:
+            if not self.radioQueue:
+                self.setRadio(False)
+        else:
+            self.setRadio(True)
+            # As soon as radio is switched on searchTimeout is called for t_search_max later.
+            # The search timer is cancelled when a message is received. Hence searchTimeout will not be called.
+            self.timers.start("search", self.intervals["t_search_max"], self.searchTimeout, 0)
+        self.log("debug", "radioOn: %s", self.radioOn)
+
+    def wakeup(self, disconnected=False):
+        self.timers.cancel("wakeup")
+        self.sendRadio("woken_up", galvanize_config.VERSION.pack(self.configVersion))
+
+    def goToSleep(self):
+        self.switchRadio(False)
+        if self.adaptive:
+            self.timers.start("wakeup", self.sleepUntilBeacon(self.intervals["t_sleep"]), self.wakeup)
+        else:
+            self.timers.start("wakeup", self.intervals["t_sleep"], self.wakeup)
+        self.log("debug", "setWakeup, sleeping for %s seconds", self.intervals["t_sleep"])
+
+    def setWakeup(self, wakeup):
+        if wakeup == 0:
+            self.timers.start("wakeup", self.intervals["t_keep_awake"], self.goToSleep)
+            self.log("debug", "setWakeup, staying awake for %s seconds", self.intervals["t_keep_awake"])
+        else:
+            if self.setInterval("t_sleep", wakeup*2):
+                self.saveState()
+            self.goToSleep()
+
+    def sendBattery(self):
+        self.sendRadio("battery_status", struct.pack(">H", 100))
+
+    def onIncludeGrant(self, data):
+        """
+        A grant's payload is the 4 ID bytes of the include_req it answers, as the node sent them,
+        then the node's new address, big-endian. Grants are sent to GRANT_ADDRESS, so every node
+        that is listening sees them. With matchGrant set, as it must be where several nodes search
+        at once (NodeHost with many nodes, the simulator), only grants that echo our ID bytes are
+        taken. Otherwise any grant is, as nothing says the bridge echoes them.
+        Returns True if the grant was taken.
+        """
+        if len(data) < GRANT_LENGTH:
+            self.log("info", "onIncludeGrant, grant too short: %s bytes", len(data))
+            return False
+        if self.matchGrant and data[0:4].tobytes() != struct.pack("I", self.nodeID):
+            if __debug__:
+                self.log("debug", "onIncludeGrant, grant for another node")
+            return False
+        self.nodeAddress = struct.unpack_from(">H", data, 4)[0]
+        self.tWait = (self.nodeAddress & 0x1F) * 0.08
+        self.log("debug", "onIncludeGrant, nodeAddress: %#06x, tWait: %s", self.nodeAddress, self.tWait)
+        return True
+
+    def saveState(self):
+        """
+        Saves what we have learnt from the bridge, if we have somewhere to save it and are
+        included. See galvanize_state.
+        """
+        if self.statePath is None or self.nodeState not in INCLUDED_STATES or self.bridgeAddress is None \
+                or self.nodeAddress == 0xFFFF:
+            return
+        state = {
+            "nodeID": self.nodeID,
+            "nodeAddress": self.nodeAddress,
+            "bridgeAddress": self.bridgeAddress,
+            "t_sleep": self.intervals["t_sleep"],
+            "revertMessage": self.revertMessage,
+            "configVersion": self.configVersion,
+            "messages": self.displayMessage,
+            "fonts": self.displayFonts,
+            "numberLines": self.numberLines
+        }
+        try:
+            galvanize_state.save(self.statePath, state)
+        except (IOError, OSError) as ex:
+            self.log("warning", "saveState, could not save to %s: %s", self.statePath, ex)
+
+    def setInterval(self, name, value):
+        """ Returns True if the interval changed. """
+        if self.intervals[name] == value:
+            return False
+        self.writable("intervals")[name] = value
+        return True
+
+    def setScreen(self, index, lines, font, numberLines):
+        """ lines is a tuple of the screen's three lines. Screens left as they are stay shared. """
+        changed = False
+        for name, value in (("displayMessage", lines), ("displayFonts", font), ("numberLines", numberLines)):
+            if getattr(self, name)[index] != value:
+                self.writable(name)[index] = value
+                changed = True
+        if changed:
+            self.display.invalidate(index)
+
+    def forgetState(self):
+        if self.statePath is not None and os.path.exists(self.statePath):
+            os.remove(self.statePath)
+
+    def restoreState(self, state=None):
+        """
+        Restores a snapshot saved by saveState and resumes in normal state, waking up to tell
+        the bridge we are back. state is the unpacked snapshot, loaded from statePath if not
+        given. Returns False, leaving the node untouched, if there is no usable snapshot
+        for this node.
+        """
+        if state is None:
+            if self.statePath is None:
+                return False
+            state = galvanize_state.load(self.statePath)
+        if state is None or state["nodeID"] != self.nodeID:
+            return False
+        if self.trace is not None:
+            self.trace.restore(self.driver.seconds(), galvanize_state.pack(state))
+        self.nodeAddress = state["nodeAddress"]
+        self.bridgeAddress = state["bridgeAddress"]
+        self.tWait = (self.nodeAddress & 0x1F) * 0.08
+        self.setInterval("t_sleep", state["t_sleep"])
+        self.revertMessage = state["revertMessage"]
+        self.configVersion = state["configVersion"]
+        for screen in galvanize_state.SCREENS:
+            self.setScreen(screen, tuple(state["messages"][screen]), state["fonts"][screen],
+                           state["numberLines"][screen])
+        self.log("info", "restoreState, resuming as node %#06x of bridge %#06x", self.nodeAddress, self.bridgeAddress)
+        self.nodeState = NORMAL
+        self.profile()
+        self.setDisplay("m1")
+        self.wakeup()
+        return True
+
+    def onConfig(self, data):
+        """ A single configuration item, after which the node no longer has any config_set version. """
+        if self.applyConfig(data, 0) is None:
+            return
+        if struct.unpack_from("B", data, 0)[0] & 0xF0 != 0xD0:    # Showing a screen changes nothing stored
+            self.configVersion = galvanize_config.UNKNOWN
+            self.saveState()
+
+    def onConfigSet(self, data):
+        """ Several configuration items in one frame. See galvanize_config. """
+        version, flags = galvanize_config.SET_HEADER.unpack_from(data, 0)
+        index = flags >> galvanize_config.INDEX_SHIFT
+        if flags & galvanize_config.FULL:
+            self.defaultConfig()
+        if index == 0:
+            self.configPending = (version, 0)
+        elif self.configPending != (version, index):
+            self.configPending = None       # Missed part of the set, so cannot take on its version
+        self.configVersion = galvanize_config.UNKNOWN
+        offset = galvanize_config.SET_HEADER.size
+        while offset is not None and offset < len(data):
+            offset = self.applyConfig(data, offset)
+        if offset is None:
+            self.configPending = None       # Items after the one not recognised were not applied
+        if self.configPending is not None:
+            if flags & galvanize_config.MORE:
+                self.configPending = (version, index + 1)
+            else:
+                self.configVersion = version
+                self.configPending = None
+        self.log("debug", "onConfigSet, version: %#010x, flags: %#x, now at: %#010x", version, flags, self.configVersion)
+        self.saveState()
+
+    def defaultConfig(self):
+        """ Goes back to the shared default display configuration. """
+        for screen in galvanize_state.SCREENS:
+            self.setScreen(screen, DISPLAY_MESSAGES[screen], DISPLAY_FONTS[screen], NUMBER_LINES[screen])
+        self.revertMessage = True
+
+    def applyConfig(self, data, offset):
+        """
+        Applies the configuration item at offset in data. Returns the offset of the next item,
+        or None if the item is not recognised, in which case its length is not known either.
+        """
+        configType = struct.unpack_from("B", data, offset)[0]
+        self.log("debug", "configType: %#x", configType)
+        if configType < 0x44:
+            length = struct.unpack_from("B", data, offset+1)[0]
+            self.log("debug", "config length: %s", length)
+            m = "m" + str((configType & 0xF0) >> 4)
+            l = (configType & 0x0f) - 1
+            lines = list(self.displayMessage[m])
+            lines[l] = data[offset+2:offset+length+2].tobytes()
+            self.setScreen(m, tuple(lines), self.displayFonts[m], self.numberLines[m])
+            self.log("debug", "new message, m: %s, l: %s, line: %s", m, l, self.displayMessage[m][l])
+            return offset + length + 2
+        elif configType & 0xF0 == 0xF0:
+            m = "m" + str(configType & 0x0F)
+            info = struct.unpack_from("B", data, offset+1)[0]
+            font = FONT_INDEX[(info & 0xF0) >> 4]
+            numLines = info & 0x0F
+            self.log("debug", "m: %s, font: %s, numLines: %s", m, font, numLines)
+            self.setScreen(m, self.displayMessage[m], font, numLines)
+        elif configType & 0xF0 == 0xB0:
+            self.revertMessage = struct.unpack_from("B", data, offset+1)[0] & 1
+        elif configType & 0xF0 == 0xD0:
+            display = DISPLAY_INDEX[struct.unpack_from("B", data, offset+1)[0]]
+            self.setDisplay(display)
+        else:
+            self.log("info", "Unrecognised config type: %#x", configType)
+            return None
+        return offset + 2
+
+    def onRadioMessage(self, message):
+        if self.trace is not None:
+            self.trace.rx(self.driver.seconds(), message)
+        if self.radioOn:
+            destination = galvanize_frame.destination(message)
+            if destination == self.nodeAddress or destination == BEACON_ADDRESS or destination == GRANT_ADDRESS:
+                self.timers.cancel("search")  # Stops 30 second search timeout when we receive a message
+                destination, source, function, length, wakeup, payload = galvanize_frame.decode(message)
+                if __debug__:
+                    self.log("debug", "onRadioMessage, source: %#06x, function: %s", source, function)
+                    if length > 6:
+                        self.driver.callFromThread(self.log, "debug", "wakeup: %s", wakeup)
+                    if length > 8:
+                        self.log("debug", "Rx: payload: %s, length: %s", lambda: payload.tobytes().encode("hex"), len(payload))
+                if function == "beacon":
+                    if self.adaptive:
+                        self.onBeacon()
+                    self.manageSend()
+                    self.dispatch(BEACON, source)
+                elif function == "include_grant":
+                    if not self.onIncludeGrant(payload):
+                        return
+                    self.dispatch(GRANT)
+                elif function == "config":
+                    self.onConfig(payload)
+                    self.sendRadio("ack")
+                elif function == "config_set":
+                    self.onConfigSet(payload)
+                    self.sendRadio("ack")
+                elif function == "send_battery":
+                    self.sendBattery
+                elif function == "ack":
+                    self.acknowledged()
+                else:
+                    self.log("info", "Unrecognised radio function: %s", function)
+                if function != "beacon":
+                    self.setWakeup(wakeup)
+    
+    def sendRadio(self, function, data = None, policy = None):
+        if True:
+        #try:
+            m = galvanize_frame.encode(self.bridgeAddress, self.nodeAddress, function, data)
+            if __debug__:
+                self.log("debug", "length: %s", len(m))
+                self.log("debug", "Tx: sending: %s", lambda: m.encode("hex"))
+            self.queueRadio(self.radioCommand(m), function, data, policy)
+        #except Exception as ex:
+        #    self.cbLog("warning", "Problem formatting message. Exception: " + str(type(ex)) + ", " + str(ex.args))
+
+    def radioCommand(self, frame):
+        """
+        Wraps a frame in the message that asks the radio adaptor to send it, base64 encoded
+        under "data". The cbridge platform carries messages as JSON, which cannot carry the
+        frame's bytes as they are. Transports that never serialise the message (the simulator,
+        NodeHost shards, trace replay) set binary and get the frame itself under "frame".
+        See commandFrame.
+        """
+        if self.binary:
+            return {"id": self.id, "request": "command", "frame": frame}
+        msg= {
+            "id": self.id,
+            "request": "command",
+            "data": base64.b64encode(frame)
+        }
+        return msg
+
+    def transmit(self, msg):
+        """ Hands a message made by radioCommand to the radio adaptor. """
+        if self.trace is not None:
+            self.trace.tx(self.driver.seconds(), commandFrame(msg))
+        self.sendMessage(msg, self.lprsID)
+
+    def randomWait(self):
+        if self.slotted:
+            r = float(random.randint(TDMA_SLOTS*SLOT_TIME, MAX_SLOTS*SLOT_TIME))/1000
+        else:
+            r =  float(random.randint(0, MAX_SLOTS*SLOT_TIME))/1000
+        if __debug__:
+            self.log("debug", "waitTime: %s", r)
+        return r
+
+    def queueRadio(self, msg, function, data=None, policy=None):
+        toQueue = {
+            "message": msg,
+            "function": function,
+            "policy": policy or function,
+            "data": data,
+            "attempt": 0,
+            "queuedAt": self.driver.seconds(),
+            "sentAt": None
+        }
+        if self.radioCounters is RADIO_COUNTERS:
+            self.radioCounters = dict(RADIO_COUNTERS)
+        self.radioQueue.push(toQueue)
+        self.switchRadio(True)
+        if __debug__:
+            self.log("debug", "queueRadio, toQueue: %s", function)
+
+    def manageSend(self):
+        """
+        Called on every beacon. Uses the retry policy of the message at the head of the queue
+        to decide whether, and when, to send it. See galvanize_send for the policy tables.
+        """
+        entry = self.radioQueue.head()
+        if entry:
+            if __debug__:
+                self.log("debug", "manageSend, radioQueue: %s", lambda: [(e["function"], e["attempt"]) for e in self.radioQueue])
+            policy = self.retryPolicies.get(entry["policy"], galvanize_send.DEFAULT_RETRY_POLICY)
+            attempts = policy["attempts"]
+            attempt = entry["attempt"]
+            if attempt < len(attempts):
+                entry["attempt"] += 1
+                action = attempts[attempt]
+                if action == galvanize_send.IDLE:
+                    return
+                if action == galvanize_send.SLOT and self.slotted and self.tWait is not None:
+                    self.radioCounters["slotted"] += 1
+                    delay = self.tWait
+                elif action == galvanize_send.RANDOM or self.slotted:
+                    self.radioCounters["contention"] += 1
+                    delay = self.randomWait()
+                else:
+                    delay = self.beaconDelay
+                self.timers.callLater(delay, self.delayedSend, entry)
+            else:
+                self.giveUp(entry, policy["give_up"])
+
+    def giveUp(self, entry, action):
+        self.log("info", "giveUp, no ack for: %s", entry["function"])
+        self.radioCounters["given_up"] += 1
+        self.metrics.givenUp(entry)
+        if action == galvanize_send.GIVE_UP_COMMS_PROBLEM:
+            self.radioCounters["comms_problem"] += 1
+            self.radioCounters["dropped"] += len(self.radioQueue)
+            self.radioQueue.clear()
+            self.setDisplay("commsProblem")
+            self.goToSleep()
+        else:
+            self.radioCounters["dropped"] += 1
+            self.radioQueue.discard(entry)
+
+    def delayedSend(self, entry):
+        if not entry["queued"]:
+            return  # Acknowledged or removed while we were waiting for our slot
+        self.radioCounters["sent"] += 1
+        if entry["attempt"] > 1:
+            self.radioCounters["retries"] += 1
+        if self.aggregate and len(self.radioQueue) > 1:
+            self.sendAggregate()
+            return
+        self.transmit(entry["message"])
+        self.metrics.sent(entry, self.driver.seconds())
+        # include_req & ack are only sent once, so delete them from the queue as soon as they are sent.
+        # They are not acked, so whatever was sent before them is still waiting for its ack
+        if self.retryPolicies.get(entry["policy"], galvanize_send.DEFAULT_RETRY_POLICY)["once"]:
+            self.radioQueue.discard(entry)
+        else:
+            self.batch = (entry,)
+
+    def sendAggregate(self):
+        """
+        Sends as much of the queue as fits in one aggregate frame. The bridge acks the frame
+        as a whole, so the entries that need an ack are kept in self.batch until it arrives.
+        """
+        size = galvanize_frame.HEADER_LENGTH + 1
+        sent = []
+        for entry in self.radioQueue:
+            size += galvanize_frame.RECORD_LENGTH + len(entry["data"] or "")
+            if size > galvanize_frame.MAX_FRAME_LENGTH:
+                break
+            sent.append(entry)
+        frame = galvanize_frame.encode_aggregate(self.bridgeAddress, self.nodeAddress,
+                                                 [(e["function"], e["data"]) for e in sent])
+        if __debug__:
+            self.log("debug", "sendAggregate, records: %s", len(sent))
+        self.transmit(self.radioCommand(frame))
+        self.radioCounters["aggregated"] += len(sent)
+        batch = []
+        now = self.driver.seconds()
+        for entry in sent:
+            self.metrics.sent(entry, now)
+            if self.retryPolicies.get(entry["policy"], galvanize_send.DEFAULT_RETRY_POLICY)["once"]:
+                self.radioQueue.discard(entry)
+            else:
+                batch.append(entry)
+        if batch:
+            self.batch = batch
+
+    def acknowledged(self):
+        """
+        The ack is for the last frame we sent that needs one, so it covers exactly the messages
+        in self.batch. Whatever has been queued ahead of them since has not been sent yet.
+        """
+        if not self.batch:
+            self.log("debug", "acknowledged, nothing waiting for an ack")
+            return
+        now = self.driver.seconds()
+        for entry in self.batch:
+            if entry["queued"]:
+                self.radioQueue.discard(entry)
+                self.metrics.acked(entry, now)
+                self.radioCounters["acked"] += 1
+        self.batch = ()
+
+    def startMetricsExport(self, interval=METRICS_INTERVAL):
+        self.timers.start("metrics", interval, self.exportMetrics, interval)
+
+    def exportMetrics(self, interval=None):
+        """
+        Sends the metrics to the manager, and schedules the next export if interval is given.
+        Also flushes the trace, so that it is never more than an export behind.
+        """
+        metrics = self.metrics.snapshot(self.driver.seconds())
+        metrics["counters"] = self.radioCounters
+        msg = {"id": self.id,
+               "status": "metrics",
+               "metrics": metrics}
+        self.sendManagerMessage(msg)
+        if self.trace is not None:
+            self.trace.flush()
+        if interval:
+            self.timers.start("metrics", interval, self.exportMetrics, interval)
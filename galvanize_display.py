@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# galvanize_display.py
+"""
+Copyright (c) 2015 ContinuumBridge Limited
+
+Display frames
+--------------
+
+Redrawing the e-paper display is the most expensive thing the node does, so screens are
+rendered once into frames and only the differences are pushed to the display.
+
+A frame is a tuple (font, line 1, line 2, line 3). Line 1 is always shown; lines 2 and 3
+are blank unless the screen's numberLines says otherwise. Frames are cached per screen
+and a screen's cached frame is thrown away when onConfig changes one of its lines, its
+font or its number of lines.
+
+Nodes that still have the default tables share one frame cache. A display given a shared
+cache copies it before its first invalidate().
+"""
+
+BLANK = ""
+
+class Display(object):
+    __slots__ = ("messages", "fonts", "numberLines", "frames", "shared", "shown")
+
+    def __init__(self, messages, fonts, numberLines, frames=None):
+        """
+        messages, fonts and numberLines are the node's displayMessage, displayFonts and
+        numberLines. frames, if given, is a frame cache shared with other displays.
+        """
+        self.tables(messages, fonts, numberLines)
+        self.frames = {} if frames is None else frames
+        self.shared = frames is not None
+        self.shown = None
+
+    def tables(self, messages, fonts, numberLines):
+        """ Called when the node replaces one of its tables with its own copy. """
+        self.messages = messages
+        self.fonts = fonts
+        self.numberLines = numberLines
+
+    def render(self, index):
+        frame = self.frames.get(index)
+        if frame is None:
+            lines = self.messages[index]
+            number = self.numberLines[index]
+            frame = (self.fonts[index],
+                     lines[0],
+                     lines[1] if number > 1 else BLANK,
+                     lines[2] if number > 2 else BLANK)
+            self.frames[index] = frame
+        return frame
+
+    def prerender(self):
+        for index in self.messages:
+            self.render(index)
+
+    def invalidate(self, index):
+        if self.shared:
+            self.frames = dict(self.frames)
+            self.shared = False
+        self.frames.pop(index, None)
+
+    def show(self, index):
+        """
+        Makes index the screen on the display. Returns a list of (position, value) for what
+        has to be redrawn, where position 0 is the font and 1 to 3 are the lines. The list
+        is empty if the display is already showing the same content.
+        """
+        frame = self.render(index)
+        shown = self.shown
+        if frame is shown:
+            return []
+        self.shown = frame
+        if shown is None or frame[0] != shown[0]:
+            # A new font means every line has to be redrawn
+            return list(enumerate(frame))
+        return [(p, frame[p]) for p in (1, 2, 3) if frame[p] != shown[p]]
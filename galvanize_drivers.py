@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+# galvanize_drivers.py
+"""
+Copyright (c) 2015 ContinuumBridge Limited
+
+Scheduling drivers
+------------------
+
+Galvanize never touches an event loop directly. Everything it needs to do with time goes
+through a driver, which provides:
+
+    seconds()                       the current time in seconds
+    callLater(delay, f, *args)      call f(*args) after delay seconds. Returns a handle
+                                    with cancel() and active() and a cancelled attribute
+    callFromThread(f, *args)        call f(*args) from the event loop's thread
+    run() / stop()                  run the event loop until stopped
+
+TwistedDriver       the Twisted reactor, as used on the cbridge platform
+AsyncioDriver       an asyncio event loop (trollius on Python 2), for asyncio based gateways
+VirtualClock        a deterministic virtual timeline that runs as fast as possible. A day
+                    of searching and backing off takes milliseconds, which is what the
+                    simulator, the benchmarks and any tests use.
+"""
+
+import heapq
+
+class TwistedDriver():
+    def __init__(self, reactor=None):
+        if reactor is None:
+            from twisted.internet import reactor
+        self.reactor = reactor
+
+    def seconds(self):
+        return self.reactor.seconds()
+
+    def callLater(self, delay, func, *args):
+        return self.reactor.callLater(delay, func, *args)
+
+    def callFromThread(self, func, *args):
+        self.reactor.callFromThread(func, *args)
+
+    def run(self):
+        self.reactor.run()
+
+    def stop(self):
+        self.reactor.stop()
+
+class AsyncioCall():
+    """ Gives an asyncio TimerHandle the DelayedCall interface. """
+    def __init__(self, func, args):
+        self.func = func
+        self.args = args
+        self.handle = None
+        self.cancelled = 0
+        self.called = 0
+
+    def fire(self):
+        self.called = 1
+        self.func(*self.args)
+
+    def active(self):
+        return not (self.cancelled or self.called)
+
+    def cancel(self):
+        if self.called:
+            raise ValueError("AsyncioCall already called")
+        self.cancelled = 1
+        self.handle.cancel()
+
+class AsyncioDriver():
+    def __init__(self, loop=None):
+        try:
+            import asyncio
+        except ImportError:
+            import trollius as asyncio
+        self.loop = loop or asyncio.get_event_loop()
+
+    def seconds(self):
+        return self.loop.time()
+
+    def callLater(self, delay, func, *args):
+        call = AsyncioCall(func, args)
+        call.handle = self.loop.call_later(delay, call.fire)
+        return call
+
+    def callFromThread(self, func, *args):
+        self.loop.call_soon_threadsafe(func, *args)
+
+    def run(self):
+        self.loop.run_forever()
+
+    def stop(self):
+        self.loop.stop()
+
+class DelayedCall():
+    def __init__(self, clock, time, seq, func, args):
+        self.clock = clock
+        self.time = time
+        self.seq = seq
+        self.func = func
+        self.args = args
+        self.cancelled = 0
+        self.called = 0
+
+    def __lt__(self, other):
+        return (self.time, self.seq) < (other.time, other.seq)
+
+    def getTime(self):
+        return self.time
+
+    def active(self):
+        return not (self.cancelled or self.called)
+
+    def cancel(self):
+        if self.called:
+            raise ValueError("DelayedCall already called")
+        self.cancelled = 1
+
+class VirtualClock():
+    """
+    Nothing happens until run() or advance() is called, which then run everything that is
+    due, in time order, as fast as possible. Calls due at the same time run in the order
+    they were scheduled, so runs are repeatable.
+    """
+    def __init__(self, now=0.0):
+        self.now = now
+        self.seq = 0
+        self.calls = []
+        self.stopped = False
+
+    def seconds(self):
+        return self.now
+
+    def callLater(self, delay, func, *args):
+        self.seq += 1
+        call = DelayedCall(self, self.now + delay, self.seq, func, args)
+        heapq.heappush(self.calls, call)
+        return call
+
+    def callFromThread(self, func, *args):
+        func(*args)
+
+    def run(self, until=None):
+        """ Runs until virtual time until, or until there is nothing left to do or stop() is called. """
+        calls = self.calls
+        self.stopped = False
+        while calls and (until is None or calls[0].time <= until) and not self.stopped:
+            call = heapq.heappop(calls)
+            if call.cancelled:
+                continue
+            self.now = call.time
+            call.called = 1
+            call.func(*call.args)
+        if until is not None and not self.stopped:
+            self.now = until
+
+    def advance(self, seconds):
+        self.run(self.now + seconds)
+
+    def stop(self):
+        self.stopped = True
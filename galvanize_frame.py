@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+# galvanize_frame.py
+"""
+Copyright (c) 2015 ContinuumBridge Limited
+
+Radio frame codec
+-----------------
+
+Every frame on the Galvanize radio starts with the same 6 byte header:
+
+    destination (2 bytes) | source (2 bytes) | function (1 byte) | length (1 byte)
+
+In frames from the bridge this is followed, if length > 6, by a 2 byte wakeup value and,
+if length > 8, by the payload. Frames from a node have no wakeup value; the payload
+follows the header directly. All values are big-endian.
+
+An aggregate frame carries several messages from a node in one transmission. Its data
+is a record count (1 byte) followed by that many records of the form:
+
+    function (1 byte) | length of data (1 byte) | data
+
+The header structs are compiled once at import time and the function code to name
+table is a flat 256 entry list, so decoding a frame is a couple of unpack_from calls
+and an index rather than repeated slicing and a search of FUNCTIONS. Incoming frames
+are wrapped in a memoryview so that the payload is returned without being copied.
+"""
+
+import struct
+
+FUNCTIONS = {
+    "include_req": 0x00,
+    "s_include_req": 0x01,
+    "include_grant": 0x02,
+    "reinclude": 0x04,
+    "config": 0x05,
+    "send_battery": 0x06,
+    "alert": 0x09,
+    "woken_up": 0x07,
+    "ack": 0x08,
+    "beacon": 0x0A,
+    "aggregate": 0x0B,
+    "config_set": 0x0C
+}
+
+# Reverse lookup, indexed by function code. Unknown codes map to None.
+FUNCTION_NAMES = [None] * 256
+for _name, _code in FUNCTIONS.items():
+    FUNCTION_NAMES[_code] = _name
+del _name, _code
+
+HEADER              = struct.Struct(">HHBB")    # destination, source, function, length
+DESTINATION         = struct.Struct(">H")
+WAKEUP              = struct.Struct(">H")
+HEADER_LENGTH       = HEADER.size
+WAKEUP_END          = HEADER_LENGTH + WAKEUP.size
+RECORD              = struct.Struct("BB")       # function, data length
+RECORD_LENGTH       = RECORD.size
+MAX_FRAME_LENGTH    = 0xFF
+
+_unpackHeader       = HEADER.unpack_from
+_unpackDestination  = DESTINATION.unpack_from
+_unpackWakeup       = WAKEUP.unpack_from
+_packHeader         = HEADER.pack
+_unpackRecord       = RECORD.unpack_from
+_packRecord         = RECORD.pack
+
+def destination(message):
+    """ Returns just the destination address, so foreign frames can be rejected cheaply. """
+    return _unpackDestination(message, 0)[0]
+
+def decode(message):
+    """
+    Decodes a received frame.
+    Returns (destination, source, function, length, wakeup, payload). function is None if the
+    code is not in FUNCTIONS. payload is a memoryview onto message (empty if there is none).
+    """
+    view = memoryview(message)
+    dest, source, code, length = _unpackHeader(view, 0)
+    if length > HEADER_LENGTH:
+        wakeup = _unpackWakeup(view, HEADER_LENGTH)[0]
+    else:
+        wakeup = 0
+    if length > WAKEUP_END:
+        payload = view[WAKEUP_END:length]
+    else:
+        payload = view[0:0]
+    return dest, source, FUNCTION_NAMES[code], length, wakeup, payload
+
+def decode_uplink(message):
+    """
+    Decodes a frame sent by a node, as seen by the bridge. Node frames have no wakeup field,
+    so the payload follows the header directly.
+    Returns (destination, source, function, length, payload).
+    """
+    view = memoryview(message)
+    dest, source, code, length = _unpackHeader(view, 0)
+    return dest, source, FUNCTION_NAMES[code], length, view[HEADER_LENGTH:length]
+
+def decode_many(messages):
+    """ Decodes an iterable of received frames. Returns a list of decode() tuples. """
+    return [decode(m) for m in messages]
+
+def encode(destination, source, function, data=None):
+    """ Builds a frame ready to be sent. function is a key of FUNCTIONS. """
+    if data:
+        return _packHeader(destination, source, FUNCTIONS[function], HEADER_LENGTH + len(data)) + data
+    else:
+        return _packHeader(destination, source, FUNCTIONS[function], HEADER_LENGTH)
+
+def encode_many(frames):
+    """ Encodes an iterable of (destination, source, function, data) tuples. Returns a list of frames. """
+    return [encode(d, s, f, data) for d, s, f, data in frames]
+
+def encode_aggregate(destination, source, records):
+    """
+    Builds an aggregate frame from an iterable of (function, data) records. data may be None.
+    The caller is responsible for keeping the frame within MAX_FRAME_LENGTH.
+    """
+    parts = []
+    for function, data in records:
+        if data:
+            parts.append(_packRecord(FUNCTIONS[function], len(data)) + data)
+        else:
+            parts.append(_packRecord(FUNCTIONS[function], 0))
+    return encode(destination, source, "aggregate", chr(len(parts)) + "".join(parts))
+
+def decode_records(payload):
+    """ Splits the payload of an aggregate frame into a list of (function, data) records. """
+    view = memoryview(payload)
+    records = []
+    offset = 1
+    for r in range(ord(view[0])):
+        code, length = _unpackRecord(view, offset)
+        offset += RECORD_LENGTH
+        records.append((FUNCTION_NAMES[code], view[offset:offset+length]))
+        offset += length
+    return records
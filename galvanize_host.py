@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+# galvanize_host.py
+"""
+Copyright (c) 2015 ContinuumBridge Limited
+
+Hosting many nodes
+------------------
+
+NodeHost puts a dispatch table in front of onRadioMessage, so that one process can host
+thousands of nodes without every node decoding and rejecting every frame:
+
+    BEACON_ADDRESS      delivered to every node
+    GRANT_ADDRESS       delivered only to the node whose ID is in the grant or, if there is
+                        no such node, to every node
+    anything else       delivered only to the node with that address, if there is one
+
+Telling grants apart relies on the bridge echoing the ID bytes of the include_req, so
+nodes that search at the same time must have matchGrant set (see Galvanize.onIncludeGrant),
+as galvanizeNode does. A host of a single node works either way.
+
+Nodes are indexed by address when they are added and again whenever a grant is delivered
+to them. A node that is restored from a snapshot after it has been added must be passed
+to index() again.
+
+ShardedHost spreads nodes across worker processes, one per shard, each of which runs a
+NodeHost on its own VirtualClock. The host steps all shards together in virtual time:
+step(until, frames, presses) hands each shard one batch holding the frames and button
+presses for its nodes, lets every shard run up to until, and returns the frames the nodes
+sent in the meantime as a list of (time, frame). Frames are routed to shards the same way
+NodeHost routes them to nodes: grants that match no node, and frames to an address whose
+shard is not known yet, go to every shard. The shard of each address is learnt from the
+grants that pass through and from the frames each shard's nodes send.
+"""
+
+import random
+import struct
+import multiprocessing
+import galvanize_frame
+from galvanize_frame import WAKEUP_END
+from galvanize_core import Galvanize, commandFrame, BEACON_ADDRESS, GRANT_ADDRESS, STATE_NAMES
+from galvanize_drivers import VirtualClock
+
+NO_ADDRESS          = 0xFFFF
+GRANT_ID            = struct.Struct("I")    # A grant's payload starts with the node's ID, as the node sent it,
+GRANT_NEW_ADDRESS   = struct.Struct(">H")   # followed by its new address
+SOURCE              = struct.Struct(">H")   # The source address of a frame, after the destination
+
+def grantID(frame):
+    """ The node ID in a grant, or None if the grant is too short to have one. """
+    if len(frame) < WAKEUP_END + GRANT_ID.size + GRANT_NEW_ADDRESS.size:
+        return None
+    return GRANT_ID.unpack_from(frame, WAKEUP_END)[0]
+
+class NodeHost():
+    def __init__(self):
+        self.nodes = []
+        self.byAddress = {}
+        self.byID = {}
+        self.addresses = {}
+
+    def addNode(self, node):
+        self.nodes.append(node)
+        self.byID[node.nodeID] = node
+        self.index(node)
+
+    def index(self, node):
+        """ Points the dispatch table at node's current address. """
+        old = self.addresses.pop(node, None)
+        if old is not None and self.byAddress.get(old) is node:
+            del self.byAddress[old]
+        if node.nodeAddress != NO_ADDRESS:
+            self.byAddress[node.nodeAddress] = node
+            self.addresses[node] = node.nodeAddress
+
+    def onRadioMessage(self, message):
+        destination = galvanize_frame.destination(message)
+        if destination == BEACON_ADDRESS:
+            for node in self.nodes:
+                node.onRadioMessage(message)
+        elif destination == GRANT_ADDRESS:
+            node = self.byID.get(grantID(message))
+            for node in (self.nodes if node is None else (node,)):
+                node.onRadioMessage(message)
+                self.index(node)
+        else:
+            node = self.byAddress.get(destination)
+            if node is not None:
+                node.onRadioMessage(message)
+
+def galvanizeNode(driver, nodeID, transport, **options):
+    """ The default node factory for ShardedHost. options are set as attributes of the node. """
+    node = Galvanize(driver, transport=transport)
+    node.id = "host"
+    node.lprsID = "radio"
+    node.binary = True
+    node.matchGrant = True
+    node.nodeID = nodeID
+    node.setLogLevel("warning")
+    for name, value in options.items():
+        setattr(node, name, value)
+    return node
+
+class Outbox():
+    """ The transport for nodes in a shard. Collects the frames they send as (time, frame). """
+    def __init__(self, clock):
+        self.clock = clock
+        self.frames = []
+
+    def cbLog(self, level, msg):
+        pass
+
+    def sendMessage(self, msg, destination):
+        self.frames.append((self.clock.now, commandFrame(msg)))
+
+    def sendManagerMessage(self, msg):
+        pass
+
+def runShard(conn, shard, nodeIDs, factory, options):
+    """ The body of a shard's worker process. """
+    random.seed(shard)
+    clock = VirtualClock()
+    outbox = Outbox(clock)
+    host = NodeHost()
+    for nodeID in nodeIDs:
+        host.addNode(factory(clock, nodeID, outbox, **options))
+    byID = dict((node.nodeID, node) for node in host.nodes)
+    while True:
+        command = conn.recv()
+        if command[0] == "step":
+            until, frames, presses = command[1:]
+            clock.run(until)
+            for frame in frames:
+                host.onRadioMessage(frame)
+            for nodeID, buttonState in presses:
+                byID[nodeID].onButtonPress(buttonState, until)
+            conn.send(outbox.frames)
+            outbox.frames = []
+        elif command[0] == "states":
+            states = {}
+            for node in host.nodes:
+                name = STATE_NAMES[node.nodeState]
+                states[name] = states.get(name, 0) + 1
+            conn.send(states)
+        elif command[0] == "stop":
+            break
+    conn.close()
+
+class ShardedHost():
+    def __init__(self, nodeIDs, shards=None, factory=galvanizeNode, options=None):
+        """
+        Node i of nodeIDs goes to shard i % shards. shards defaults to the number of cores.
+        factory(driver, nodeID, transport, **options) makes a node and must be picklable.
+        """
+        self.shards = shards or multiprocessing.cpu_count()
+        self.shardOfID = {}
+        self.shardOfAddress = {}
+        self.conns = []
+        self.processes = []
+        for shard in range(self.shards):
+            ids = nodeIDs[shard::self.shards]
+            for nodeID in ids:
+                self.shardOfID[nodeID] = shard
+            conn, child = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=runShard, args=(child, shard, ids, factory, options or {}))
+            process.daemon = True
+            process.start()
+            self.conns.append(conn)
+            self.processes.append(process)
+
+    def route(self, frame):
+        """ Returns the shards to hand frame to. """
+        destination = galvanize_frame.destination(frame)
+        if destination == BEACON_ADDRESS:
+            return range(self.shards)
+        if destination == GRANT_ADDRESS:
+            shard = self.shardOfID.get(grantID(frame))
+            if shard is None:
+                return range(self.shards)
+            address = GRANT_NEW_ADDRESS.unpack_from(frame, WAKEUP_END + GRANT_ID.size)[0]
+            self.shardOfAddress[address] = shard
+            return (shard,)
+        shard = self.shardOfAddress.get(destination)
+        return range(self.shards) if shard is None else (shard,)
+
+    def step(self, until, frames=(), presses=()):
+        """
+        Delivers frames and presses, a list of (nodeID, buttonState), at virtual time until
+        and returns the frames sent by nodes up to then, in time order.
+        """
+        batches = [([], []) for shard in range(self.shards)]
+        for frame in frames:
+            for shard in self.route(frame):
+                batches[shard][0].append(frame)
+        for nodeID, buttonState in presses:
+            batches[self.shardOfID[nodeID]][1].append((nodeID, buttonState))
+        for conn, (shardFrames, shardPresses) in zip(self.conns, batches):
+            conn.send(("step", until, shardFrames, shardPresses))
+        sent = []
+        for shard, conn in enumerate(self.conns):
+            shardSent = conn.recv()
+            for now, frame in shardSent:
+                source = SOURCE.unpack_from(frame, 2)[0]
+                if source != NO_ADDRESS:
+                    self.shardOfAddress[source] = shard
+            sent.extend(shardSent)
+        sent.sort(key=lambda s: s[0])
+        return sent
+
+    def states(self):
+        """ Returns the number of nodes in each state, over all shards. """
+        for conn in self.conns:
+            conn.send(("states",))
+        states = {}
+        for conn in self.conns:
+            for state, count in conn.recv().items():
+                states[state] = states.get(state, 0) + count
+        return states
+
+    def stop(self):
+        for conn in self.conns:
+            conn.send(("stop",))
+        for process in self.processes:
+            process.join()
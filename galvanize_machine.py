@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# galvanize_machine.py
+"""
+Copyright (c) 2015 ContinuumBridge Limited
+
+Table driven state machines
+---------------------------
+
+A state machine is declared as rows of (state, event, action, next state), where states
+and events are small integers and action is the name of a method of the object whose
+state it is, or None. A row for state ANY applies to every state that does not have a
+row of its own for the event, and a next state of SAME leaves the state as it is.
+
+Machine compiles the rows into flat arrays indexed by state * number of events + event,
+which all nodes share. dispatch() is two array lookups and, if there is an action, one
+method call. The new state is set before the action is called, so an action can
+dispatch a further event.
+
+validate() lists the (state, event) pairs no row covers, the states that cannot be
+reached from the initial state and, given a class, the actions it does not have.
+Running this module validates and prints the node's machine from galvanize_core:
+
+    python galvanize_machine.py
+"""
+
+import sys
+from array import array
+
+ANY         = -1
+SAME        = -1
+NO_ACTION   = 0
+
+class Machine(object):
+    __slots__ = ("stateNames", "eventNames", "numEvents", "actionNames", "actions", "nextStates",
+                 "handled", "initial")
+
+    def __init__(self, rows, stateNames, eventNames, initial=0):
+        self.stateNames = stateNames
+        self.eventNames = eventNames
+        self.numEvents = len(eventNames)
+        self.initial = initial
+        self.actionNames = [None]
+        size = len(stateNames) * self.numEvents
+        self.actions = array("B", [NO_ACTION] * size)
+        self.nextStates = array("b", [state for state in range(len(stateNames)) for event in eventNames])
+        self.handled = [False] * size
+        # Wildcard rows first, so that rows for particular states override them
+        for state, event, action, nextState in sorted(rows, key=lambda row: row[0] != ANY):
+            for s in (range(len(stateNames)) if state == ANY else (state,)):
+                i = s * self.numEvents + event
+                self.actions[i] = self.actionIndex(action)
+                self.nextStates[i] = s if nextState == SAME else nextState
+                self.handled[i] = True
+
+    def actionIndex(self, action):
+        if action is None:
+            return NO_ACTION
+        if action not in self.actionNames:
+            self.actionNames.append(action)
+        return self.actionNames.index(action)
+
+    def dispatch(self, node, event, *args):
+        """ Moves node.nodeState on for event, calling the transition's action with args. """
+        i = node.nodeState * self.numEvents + event
+        action = self.actions[i]
+        node.nodeState = self.nextStates[i]
+        if action:
+            getattr(node, self.actionNames[action])(*args)
+
+    def dispatchMany(self, events):
+        """ events is an iterable of (node, event, args), dispatched in order. """
+        actions = self.actions
+        nextStates = self.nextStates
+        actionNames = self.actionNames
+        numEvents = self.numEvents
+        for node, event, args in events:
+            i = node.nodeState * numEvents + event
+            action = actions[i]
+            node.nodeState = nextStates[i]
+            if action:
+                getattr(node, actionNames[action])(*args)
+
+    def validate(self, cls=None):
+        """ Returns a list of problems with the machine, empty if there are none. """
+        problems = []
+        for i, handled in enumerate(self.handled):
+            if not handled:
+                problems.append("unhandled: %s in state %s" % (self.eventNames[i % self.numEvents],
+                                                              self.stateNames[i // self.numEvents]))
+        reached = set([self.initial])
+        frontier = [self.initial]
+        while frontier:
+            state = frontier.pop()
+            for event in range(self.numEvents):
+                nextState = self.nextStates[state * self.numEvents + event]
+                if nextState not in reached:
+                    reached.add(nextState)
+                    frontier.append(nextState)
+        for state, name in enumerate(self.stateNames):
+            if state not in reached:
+                problems.append("unreachable: state %s" % name)
+        if cls is not None:
+            for name in self.actionNames[1:]:
+                if not callable(getattr(cls, name, None)):
+                    problems.append("no action: %s.%s" % (cls.__name__, name))
+        return problems
+
+    def describe(self):
+        """ Returns the compiled table as lines of text. """
+        lines = []
+        for state, stateName in enumerate(self.stateNames):
+            for event, eventName in enumerate(self.eventNames):
+                i = state * self.numEvents + event
+                if self.handled[i]:
+                    lines.append("%-12s %-14s %-18s %s" % (stateName, eventName,
+                                 self.actionNames[self.actions[i]] or "-", self.stateNames[self.nextStates[i]]))
+        return lines
+
+def main(argv):
+    import galvanize_core
+    machine = galvanize_core.MACHINE
+    for line in machine.describe():
+        print(line)
+    problems = machine.validate(galvanize_core.Galvanize)
+    for problem in problems:
+        print(problem)
+    return 1 if problems else 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+# galvanize_metrics.py
+"""
+Copyright (c) 2015 ContinuumBridge Limited
+
+Node instrumentation
+--------------------
+
+NodeMetrics records, for every message function, how long messages spend between being
+queued and first sent, and between being queued and acked, in LatencyHistograms, and how
+many manageSend attempts messages took to be acked or to be given up on. It also
+keeps track of how long the radio has been on, and profiles the radio duty cycle by phase:
+how long the node has spent in each of PHASES, and how much of that time its radio was on.
+
+A function's histograms are allocated the first time it is recorded, after which
+recording is a little arithmetic and a list increment and can be left on in production.
+snapshot() builds the dict that Galvanize exports with sendManagerMessage.
+"""
+
+from galvanize_frame import FUNCTIONS
+
+SEARCH          = 0     # Looking for the network, or not yet started
+INCLUDE         = 1     # Asked to be included, waiting for the grant
+NORMAL          = 2     # Included, with the radio on
+SLEEPING        = 3     # Included, with the radio off
+PHASES          = ("search", "include", "normal", "sleeping")
+ATTEMPT_BUCKETS = 16    # Attempt counts of ATTEMPT_BUCKETS - 1 and over share the last bucket
+
+class LatencyHistogram(object):
+    """
+    HDR style histogram of latencies with millisecond resolution. Values below 2*SUB_BUCKETS ms
+    are counted exactly; above that each power of two is split into SUB_BUCKETS buckets, so the
+    error is under 1/SUB_BUCKETS. Values above MAX_MS are counted in the last bucket.
+    """
+    SUB_BITS        = 4
+    SUB_BUCKETS     = 1 << SUB_BITS
+    MAX_SHIFT       = 16                # Top bucket starts at 2**(MAX_SHIFT+SUB_BITS) ms, about 17 minutes
+    SIZE            = (MAX_SHIFT + 2) * SUB_BUCKETS
+    MAX_MS          = (1 << (MAX_SHIFT + SUB_BITS + 1)) - 1
+
+    __slots__ = ("counts", "count", "total", "max")
+
+    def __init__(self):
+        self.counts = [0] * self.SIZE
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def index(self, ms):
+        if ms < 2 * self.SUB_BUCKETS:
+            return ms
+        shift = ms.bit_length() - self.SUB_BITS - 1
+        return shift * self.SUB_BUCKETS + (ms >> shift)
+
+    def value(self, index):
+        """ The lowest value, in ms, counted in bucket index. """
+        if index < 2 * self.SUB_BUCKETS:
+            return index
+        shift = index // self.SUB_BUCKETS - 1
+        return (index - shift * self.SUB_BUCKETS) << shift
+
+    def record(self, seconds):
+        ms = int(seconds * 1000)
+        if ms > self.MAX_MS:
+            ms = self.MAX_MS
+        elif ms < 0:
+            ms = 0
+        self.counts[self.index(ms)] += 1
+        self.count += 1
+        self.total += ms
+        if ms > self.max:
+            self.max = ms
+
+    def percentile(self, p):
+        """ Returns the p'th percentile in seconds, or None if nothing has been recorded. """
+        if not self.count:
+            return None
+        target = self.count * p / 100.0
+        seen = 0
+        for index, n in enumerate(self.counts):
+            seen += n
+            if n and seen >= target:
+                return min(self.value(index), self.max) / 1000.0
+        return self.max / 1000.0
+
+    def reset(self):
+        for i in range(self.SIZE):
+            self.counts[i] = 0
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "mean": self.total / 1000.0 / self.count if self.count else None,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+            "max": self.max / 1000.0
+        }
+
+class NodeMetrics(object):
+    __slots__ = ("queueLatency", "ackLatency", "ackAttempts", "giveUpAttempts", "radioOn", "since",
+                 "radioOnTime", "startTime", "phase", "phaseTime", "phaseRadioTime")
+
+    def __init__(self, now):
+        self.queueLatency = {}
+        self.ackLatency = {}
+        self.ackAttempts = {}
+        self.giveUpAttempts = {}
+        self.radioOn = False
+        self.since = now
+        self.radioOnTime = 0.0
+        self.startTime = now
+        self.phase = SEARCH
+        self.phaseTime = [0.0] * len(PHASES)
+        self.phaseRadioTime = [0.0] * len(PHASES)
+
+    def sent(self, entry, now):
+        """ Called when entry is sent. Only the first send counts towards queue latency. """
+        if entry["sentAt"] is None:
+            entry["sentAt"] = now
+            histogram = self.histogram(self.queueLatency, entry["function"])
+            if histogram:
+                histogram.record(now - entry["queuedAt"])
+
+    def acked(self, entry, now):
+        histogram = self.histogram(self.ackLatency, entry["function"])
+        if histogram:
+            histogram.record(now - entry["queuedAt"])
+        self.attempts(self.ackAttempts, entry)
+
+    def givenUp(self, entry):
+        self.attempts(self.giveUpAttempts, entry)
+
+    def attempts(self, histograms, entry):
+        """ Counts the attempts entry has had in the function's histogram, a list of ATTEMPT_BUCKETS counts. """
+        function = entry["function"]
+        counts = histograms.get(function)
+        if counts is None:
+            if function not in FUNCTIONS:
+                return
+            counts = histograms[function] = [0] * ATTEMPT_BUCKETS
+        counts[min(entry["attempt"], ATTEMPT_BUCKETS - 1)] += 1
+
+    def histogram(self, histograms, function):
+        """ Returns the histogram for function, making it if need be, or None if function is not known. """
+        histogram = histograms.get(function)
+        if histogram is None and function in FUNCTIONS:
+            histogram = histograms[function] = LatencyHistogram()
+        return histogram
+
+    def account(self, now):
+        elapsed = now - self.since
+        self.phaseTime[self.phase] += elapsed
+        if self.radioOn:
+            self.radioOnTime += elapsed
+            self.phaseRadioTime[self.phase] += elapsed
+        self.since = now
+
+    def radio(self, on, now):
+        if on != self.radioOn:
+            self.account(now)
+            self.radioOn = on
+
+    def enter(self, phase, now):
+        """ Called when the node moves to phase, one of PHASES. """
+        if phase != self.phase:
+            self.account(now)
+            self.phase = phase
+
+    def radioTime(self, now):
+        """ Total time, in seconds, that the radio has been on. """
+        if self.radioOn:
+            return self.radioOnTime + now - self.since
+        return self.radioOnTime
+
+    def dutyCycle(self, now):
+        """ Returns {phase: {"time", "radio_on", "duty"}} for every phase the node has been in. """
+        self.account(now)
+        duty = {}
+        for phase, name in enumerate(PHASES):
+            if self.phaseTime[phase]:
+                duty[name] = {
+                    "time": self.phaseTime[phase],
+                    "radio_on": self.phaseRadioTime[phase],
+                    "duty": self.phaseRadioTime[phase] / self.phaseTime[phase]
+                }
+        return duty
+
+    def snapshot(self, now):
+        elapsed = now - self.startTime
+        radioTime = self.radioTime(now)
+        return {
+            "elapsed": elapsed,
+            "radio_on_time": radioTime,
+            "radio_duty": radioTime / elapsed if elapsed else 0.0,
+            "duty_cycle": self.dutyCycle(now),
+            "queue_latency": dict((f, h.summary()) for f, h in self.queueLatency.items() if h.count),
+            "ack_latency": dict((f, h.summary()) for f, h in self.ackLatency.items() if h.count),
+            "ack_attempts": dict((f, trimmed(counts)) for f, counts in self.ackAttempts.items()),
+            "give_up_attempts": dict((f, trimmed(counts)) for f, counts in self.giveUpAttempts.items())
+        }
+
+def trimmed(counts):
+    """ counts without its trailing zeros. Index n is the number of messages that took n attempts. """
+    end = len(counts)
+    while end and not counts[end - 1]:
+        end -= 1
+    return counts[:end]
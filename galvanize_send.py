@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+# galvanize_send.py
+"""
+Copyright (c) 2015 ContinuumBridge Limited
+
+Outgoing radio queue and retry policies
+---------------------------------------
+
+Messages waiting to be sent are held in a SendQueue, which keeps one deque per priority
+class so that enqueue, dequeue and looking at the head are all O(1). Acks go before
+include requests, which go before alerts, which go before everything else.
+
+How often, and when, a message is retried is described by RETRY_POLICIES rather than
+by code. Each beacon that arrives while a message is at the head of the queue uses up
+one entry of its "attempts" tuple:
+
+    SLOT    send in the node's own slot (tWait after the beacon) in slotted mode,
+            otherwise as BEACON
+    BEACON  send beaconDelay after the beacon
+    RANDOM  send in a random slot of the frame
+    IDLE    do not send on this beacon
+
+In slotted mode only SLOT uses a fixed time. Everything else, including SLOT for a node
+that has not been included yet, is sent at random in the contention slots at the end
+of the frame.
+
+When the attempts run out, the "give_up" action is taken:
+
+    GIVE_UP_COMMS_PROBLEM   empty the queue, display commsProblem and go to sleep
+    GIVE_UP_DROP            just drop the message
+
+Messages with "once" set are removed from the queue as soon as they have been sent.
+
+A message uses the policy named after its function unless it was queued with another.
+include_req is first sent at the fixed BEACON time. If no grant comes, the node asks again
+once with the include_retry policy, which sends at random times on every beacon, then
+every second and then every fourth, so that nodes which collided spread out. The grant removes
+it from the queue. If it is given up, the node goes back to searching (see
+Galvanize.retryInclusion), so a bridge that never grants is not asked on every beacon.
+"""
+
+from collections import deque
+
+BEACON                  = 0
+RANDOM                  = 1
+IDLE                    = 2
+SLOT                    = 3
+
+GIVE_UP_COMMS_PROBLEM   = 0
+GIVE_UP_DROP            = 1
+
+PRIORITIES = {
+    "ack": 0,
+    "include_req": 1,
+    "alert": 2,
+    "battery_status": 3
+}
+DEFAULT_PRIORITY        = 3
+NUM_PRIORITIES          = 4
+
+DEFAULT_RETRY_POLICY = {
+    "attempts": (SLOT, RANDOM, RANDOM,
+                 IDLE, IDLE, IDLE, IDLE, IDLE, IDLE,
+                 BEACON, RANDOM, RANDOM, RANDOM),
+    "give_up": GIVE_UP_COMMS_PROBLEM,
+    "once": False
+}
+RETRY_POLICIES = {
+    "ack": {
+        "attempts": (SLOT,),
+        "give_up": GIVE_UP_DROP,
+        "once": True
+    },
+    "include_req": {
+        "attempts": (BEACON,),
+        "give_up": GIVE_UP_DROP,
+        "once": True
+    },
+    "include_retry": {
+        "attempts": (RANDOM, RANDOM, RANDOM, RANDOM,
+                     IDLE, RANDOM, IDLE, RANDOM, IDLE, RANDOM, IDLE, RANDOM,
+                     IDLE, IDLE, IDLE, RANDOM, IDLE, IDLE, IDLE, RANDOM,
+                     IDLE, IDLE, IDLE, RANDOM, IDLE, IDLE, IDLE, RANDOM),
+        "give_up": GIVE_UP_DROP,
+        "once": False
+    },
+    "alert": DEFAULT_RETRY_POLICY,
+    "battery_status": DEFAULT_RETRY_POLICY,
+    "woken_up": DEFAULT_RETRY_POLICY
+}
+
+class SendQueue(object):
+    """
+    Priority queue of outgoing messages. Entries are dicts with at least "function" and
+    "attempt" keys. An entry's "queued" key is True while it is in the queue. The deques
+    are only made on the first push, as most nodes never send anything.
+    """
+    __slots__ = ("priorities", "queues", "length")
+
+    def __init__(self, priorities=PRIORITIES):
+        self.priorities = priorities
+        self.queues = ()
+        self.length = 0
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        for q in self.queues:
+            for entry in q:
+                yield entry
+
+    def push(self, entry):
+        if not self.queues:
+            self.queues = [deque() for p in range(NUM_PRIORITIES)]
+        entry["queued"] = True
+        self.queues[self.priorities.get(entry["function"], DEFAULT_PRIORITY)].append(entry)
+        self.length += 1
+
+    def head(self):
+        """ Returns the next entry to be sent, or None if the queue is empty. """
+        if self.length:
+            for q in self.queues:
+                if q:
+                    return q[0]
+        return None
+
+    def pop(self):
+        """ Removes and returns the head of the queue. Raises IndexError if the queue is empty. """
+        for q in self.queues:
+            if q:
+                entry = q.popleft()
+                entry["queued"] = False
+                self.length -= 1
+                return entry
+        raise IndexError("pop from empty SendQueue")
+
+    def discard(self, entry):
+        """
+        Removes entry, and not an equal one, if it is still queued. O(1) when entry is at the
+        head of its class.
+        """
+        if entry.get("queued"):
+            q = self.queues[self.priorities.get(entry["function"], DEFAULT_PRIORITY)]
+            if q[0] is entry:
+                q.popleft()
+            else:
+                for i, queued in enumerate(q):
+                    if queued is entry:
+                        del q[i]
+                        break
+            entry["queued"] = False
+            self.length -= 1
+
+    def clear(self):
+        for q in self.queues:
+            for entry in q:
+                entry["queued"] = False
+            q.clear()
+        self.length = 0
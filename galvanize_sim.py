@@ -0,0 +1,364 @@
+#!/usr/bin/env python
+# galvanize_sim.py
+"""
+Copyright (c) 2015 ContinuumBridge Limited
+
+Multi-node network simulator
+----------------------------
+
+Runs any number of Galvanize nodes against a simulated bridge on a virtual clock, so
+the node logic can be exercised without the cbridge platform or a real LPRS radio.
+
+The bridge sends a beacon to BEACON_ADDRESS every beaconInterval seconds, answers
+include_req with an include_grant to GRANT_ADDRESS and acks everything else that is
+sent to it. Given a configuration with setConfig, it pushes it to nodes as they wake up.
+outage(start, duration) takes it off the air for a while, keeping its beacon timing.
+
+All transmissions, from the bridge and from the nodes, share one radio channel: two
+transmissions that overlap in time are both lost.
+
+Each node is switched on with a long press at a random time in the first startSpread
+seconds. Once it has been included it is pressed at random (on average every
+pressInterval seconds), which raises or clears an alert.
+
+Run as a script to get a load table for a range of node counts, with each count run
+with the original random transmit timing, in slotted mode and in slotted mode with
+aggregation:
+
+    python galvanize_sim.py [--wheel] [duration] [nodes] [nodes] ...
+
+--wheel puts the timers of all the nodes on one shared galvanize_timers.TimerWheel.
+"""
+
+import os
+import sys
+import time
+import struct
+import random
+import galvanize_frame
+import galvanize_timers
+import galvanize_config
+from galvanize_drivers import VirtualClock
+from galvanize_core import Galvanize, commandFrame, BEACON_ADDRESS, GRANT_ADDRESS, NORMAL, PRESSED
+
+BRIDGE_ADDRESS      = 0x1000
+BEACON_INTERVAL     = 3.0       # Seconds between beacons
+TURNAROUND          = 0.1       # Seconds between the bridge receiving a frame and replying
+BIT_RATE            = 19200     # Radio bit rate, used to work out airtime
+PREAMBLE_BYTES      = 10        # Sent over the air in front of every frame
+
+class Channel():
+    def __init__(self, network, bitRate=BIT_RATE):
+        self.network = network
+        self.clock = network.clock
+        self.bitRate = bitRate
+        self.active = []
+        self.transmissions = 0
+        self.collisions = 0
+
+    def airtime(self, frame):
+        return (PREAMBLE_BYTES + len(frame)) * 8.0 / self.bitRate
+
+    def transmit(self, sender, frame):
+        tx = [sender, frame, False]
+        for other in self.active:
+            other[2] = True
+            tx[2] = True
+        self.active.append(tx)
+        self.transmissions += 1
+        self.clock.callLater(self.airtime(frame), self.complete, tx)
+
+    def complete(self, tx):
+        self.active.remove(tx)
+        sender, frame, collided = tx
+        if collided:
+            self.collisions += 1
+        elif sender is self.network.bridge:
+            for node in self.network.nodes:
+                node.onRadioMessage(frame)
+        else:
+            self.network.bridge.onRadioMessage(frame)
+
+class SimBridge():
+    def __init__(self, network, address=BRIDGE_ADDRESS, beaconInterval=BEACON_INTERVAL, turnaround=TURNAROUND):
+        self.network = network
+        self.clock = network.clock
+        self.address = address
+        self.beaconInterval = beaconInterval
+        self.turnaround = turnaround
+        self.addresses = {}
+        self.nextAddress = 1
+        self.received = 0
+        self.acks = 0
+        self.beaconFrame = galvanize_frame.encode(BEACON_ADDRESS, address, "beacon")
+        self.config = None
+        self.configVersion = galvanize_config.UNKNOWN
+        self.bulkConfig = True
+        self.pushed = {}
+        self.configFrames = 0
+        self.configBytes = 0
+        self.configSkipped = 0
+        self.down = False
+
+    def setConfig(self, items, bulk=True):
+        """
+        Pushes the configuration made of galvanize_config items to every node that does not
+        have it, when it next wakes up. With bulk False the items are pushed in one config
+        frame each and, as nodes cannot say what they have, each node is pushed to once.
+        """
+        self.config = items
+        self.configVersion = galvanize_config.version(items)
+        self.bulkConfig = bulk
+
+    def start(self):
+        self.clock.callLater(0, self.beacon)
+
+    def outage(self, start, duration):
+        """ The bridge neither sends nor receives from start for duration seconds. """
+        self.clock.callLater(start, setattr, self, "down", True)
+        self.clock.callLater(start + duration, setattr, self, "down", False)
+
+    def beacon(self):
+        if not self.down:
+            self.network.channel.transmit(self, self.beaconFrame)
+        self.clock.callLater(self.beaconInterval, self.beacon)
+
+    def reply(self, destination, function, data=None, delay=None):
+        frame = galvanize_frame.encode(destination, self.address, function, data)
+        self.clock.callLater(self.turnaround if delay is None else delay, self.network.channel.transmit, self, frame)
+        return frame
+
+    def pushConfig(self, source, version):
+        """ Called when a node wakes up, with the configuration version it has. """
+        if self.bulkConfig:
+            current = version == self.configVersion
+        else:
+            current = self.pushed.get(source) == self.configVersion
+        if current:
+            self.configSkipped += 1
+            return
+        if self.bulkConfig:
+            frames = [("config_set", p) for p in galvanize_config.encode(self.config, self.configVersion)]
+        else:
+            frames = [("config", item) for item in self.config]
+            self.pushed[source] = self.configVersion
+        # Follow the ack to the woken_up, one frame after another
+        delay = self.turnaround + self.network.channel.airtime(galvanize_frame.encode(source, self.address, "ack"))
+        for function, data in frames:
+            delay += self.turnaround
+            frame = self.reply(source, function, galvanize_frame.WAKEUP.pack(0) + data, delay)
+            delay += self.network.channel.airtime(frame)
+            self.configFrames += 1
+            self.configBytes += len(frame)
+
+    def onRadioMessage(self, frame):
+        destination, source, function, length, payload = galvanize_frame.decode_uplink(frame)
+        if destination != self.address or self.down:
+            return
+        if function == "aggregate":
+            needAck = False
+            for function, data in galvanize_frame.decode_records(payload):
+                needAck = self.onRecord(source, function, data) or needAck
+        else:
+            needAck = self.onRecord(source, function, payload)
+        if needAck:
+            self.reply(source, "ack")
+
+    def onRecord(self, source, function, payload):
+        """ Handles one message from a node. Returns True if it needs to be acked. """
+        self.received += 1
+        if function == "include_req":
+            nodeID = payload[0:4].tobytes()
+            if nodeID not in self.addresses:
+                self.addresses[nodeID] = self.nextAddress
+                self.nextAddress += 1
+            self.reply(GRANT_ADDRESS, "include_grant",
+                       galvanize_frame.WAKEUP.pack(0) + nodeID + struct.pack(">H", self.addresses[nodeID]))
+            return False
+        if function == "ack":
+            self.acks += 1
+            return False
+        if function == "woken_up" and self.config is not None:
+            version = galvanize_config.VERSION.unpack_from(payload)[0] if len(payload) >= 4 else galvanize_config.UNKNOWN
+            self.pushConfig(source, version)
+        return True
+
+class SimNode(Galvanize):
+    """ A Galvanize node connected to the simulated channel, with hooks to collect results. """
+    def __init__(self, network, nodeID):
+        Galvanize.__init__(self, network.clock, network.timerService)
+        self.network = network
+        self.nodeID = nodeID
+        self.id = "sim"
+        self.lprsID = "sim"
+        self.binary = True
+        self.matchGrant = True
+        self.startedAt = None
+        self.includedAt = None
+        self.restoredAt = None
+        self.firstAckAt = None
+        self.heardAt = None
+        self.setLogLevel("warning")
+
+    def cbLog(self, level, msg):
+        pass
+
+    def sendManagerMessage(self, msg):
+        pass
+
+    def sendMessage(self, msg, lprsID):
+        self.network.channel.transmit(self, commandFrame(msg))
+
+    def onIncludeGrant(self, data):
+        if Galvanize.onIncludeGrant(self, data):
+            if self.includedAt is None:
+                self.includedAt = self.network.clock.now
+            self.heardAt = self.network.clock.now
+            return True
+        return False
+
+    def acknowledged(self):
+        if self.firstAckAt is None:
+            self.firstAckAt = self.network.clock.now
+        self.heardAt = self.network.clock.now
+        for entry in self.batch:
+            if entry["queued"] and "pressTime" in entry:
+                self.network.latencies.append(self.network.clock.now - entry["pressTime"])
+        Galvanize.acknowledged(self)
+
+    def giveUp(self, entry, action):
+        self.network.givenUp += 1
+        Galvanize.giveUp(self, entry, action)
+
+    def press(self, duration):
+        clock = self.network.clock
+        self.onButtonPress(1, clock.now)
+        clock.callLater(duration, self.release, clock.now + duration)
+
+    def release(self, timeStamp):
+        self.onButtonPress(0, timeStamp)
+        for entry in self.radioQueue:
+            if entry["function"] == "alert" and "pressTime" not in entry:
+                entry["pressTime"] = timeStamp
+                self.network.alerts += 1
+
+class Network():
+    def __init__(self, numNodes, seed=1, startSpread=60.0, pressInterval=120.0,
+                 beaconInterval=BEACON_INTERVAL, bitRate=BIT_RATE, slotted=False, aggregate=False,
+                 timerWheel=False, stateDir=None, adaptive=False):
+        self.clock = VirtualClock()
+        if timerWheel:
+            self.timerService = galvanize_timers.TimerWheel(self.clock)
+        else:
+            self.timerService = galvanize_timers.ReactorTimerService(self.clock)
+        self.random = random.Random(seed)
+        random.seed(seed)       # Galvanize.randomWait uses the module random
+        self.startSpread = startSpread
+        self.pressInterval = pressInterval
+        self.channel = Channel(self, bitRate)
+        self.bridge = SimBridge(self, beaconInterval=beaconInterval)
+        self.nodes = [SimNode(self, 1000 + n) for n in range(numNodes)]
+        for node in self.nodes:
+            if stateDir is not None:
+                node.statePath = os.path.join(stateDir, "%d.state" % node.nodeID)
+            node.slotted = slotted
+            node.aggregate = aggregate
+            node.adaptive = adaptive
+        self.mode = ("slotted" if slotted else "random") + ("+agg" if aggregate else "")
+        self.latencies = []
+        self.alerts = 0
+        self.givenUp = 0
+
+    def switchOn(self, node):
+        """ Restores the node from its snapshot if it has one, otherwise a long press starts it. """
+        node.startedAt = self.clock.now
+        if node.restoreState():
+            node.restoredAt = self.clock.now
+        else:
+            node.press(node.intervals["t_start_press"] + 1)
+
+    def userPress(self, node):
+        if node.nodeState == NORMAL:
+            node.press(0.2)
+        elif node.nodeState == PRESSED:
+            node.press(4)
+        self.clock.callLater(self.random.expovariate(1.0/self.pressInterval), self.userPress, node)
+
+    def run(self, duration):
+        self.bridge.start()
+        for node in self.nodes:
+            self.clock.callLater(self.random.uniform(0, self.startSpread), self.switchOn, node)
+            self.clock.callLater(self.startSpread + self.random.expovariate(1.0/self.pressInterval), self.userPress, node)
+        self.clock.run(duration)
+        return self.results(duration)
+
+    def results(self, duration):
+        included = [n.includedAt - n.startedAt for n in self.nodes if n.includedAt is not None]
+        return {
+            "mode": self.mode,
+            "nodes": len(self.nodes),
+            "included": len(included),
+            "inclusion_p50": percentile(included, 50),
+            "inclusion_p95": percentile(included, 95),
+            "alerts": self.alerts,
+            "acked": len(self.latencies),
+            "given_up": self.givenUp,
+            "throughput": self.bridge.received / float(duration),
+            "latency_p50": percentile(self.latencies, 50),
+            "latency_p95": percentile(self.latencies, 95),
+            "latency_p99": percentile(self.latencies, 99),
+            "transmissions": self.channel.transmissions,
+            "retries": sum(n.radioCounters["retries"] for n in self.nodes),
+            "aggregated": sum(n.radioCounters["aggregated"] for n in self.nodes),
+            "radio_duty": sum(n.metrics.radioTime(duration) for n in self.nodes) / duration / len(self.nodes),
+            "collisions": self.channel.collisions
+        }
+
+def percentile(values, p):
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100.0))]
+
+COLUMNS = (
+    ("mode", "%12s"),
+    ("nodes", "%7d"),
+    ("included", "%9d"),
+    ("inclusion_p50", "%14.1f"),
+    ("inclusion_p95", "%14.1f"),
+    ("alerts", "%7d"),
+    ("acked", "%6d"),
+    ("given_up", "%9d"),
+    ("throughput", "%11.2f"),
+    ("latency_p50", "%12.2f"),
+    ("latency_p95", "%12.2f"),
+    ("latency_p99", "%12.2f"),
+    ("retries", "%8d"),
+    ("aggregated", "%11d"),
+    ("collisions", "%11d"),
+    ("radio_duty", "%11.3f"),
+    ("wall", "%6.1f")
+)
+
+MODES = (
+    {},
+    {"slotted": True},
+    {"slotted": True, "aggregate": True}
+)
+
+def main(argv):
+    timerWheel = "--wheel" in argv
+    if timerWheel:
+        argv.remove("--wheel")
+    duration = float(argv[1]) if len(argv) > 1 else 900.0
+    counts = [int(a) for a in argv[2:]] or [1, 10, 30, 100, 300, 1000]
+    print(" ".join(name.rjust(len(fmt % ("" if fmt.endswith("s") else 0))) for name, fmt in COLUMNS))
+    for count in counts:
+        for options in MODES:
+            start = time.time()
+            results = Network(count, timerWheel=timerWheel, **options).run(duration)
+            results["wall"] = time.time() - start
+            print(" ".join(fmt % results[name] for name, fmt in COLUMNS))
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+# galvanize_state.py
+"""
+Copyright (c) 2015 ContinuumBridge Limited
+
+Node state snapshots
+--------------------
+
+Everything a node learns from the bridge (its address, the bridge address, its wakeup
+interval and the display configuration) is saved in a small binary snapshot, so that
+after a restart the node can go straight back to normal instead of searching for the
+network and asking to be included again.
+
+Version 1 snapshots, which have no configVersion, are still read, with configVersion 0.
+
+Snapshot layout, all big-endian:
+
+    magic "GVNS" | version (1 byte) | nodeID (4) | nodeAddress (2) | bridgeAddress (2) |
+    t_sleep (4) | revertMessage (1) | configVersion (4) |
+    for each of SCREENS: font (1) | numberLines (1) | 3 x (length (1) | line)
+    crc32 of everything before it (4)
+
+Snapshots are written to a temporary file which is then renamed over the old one, so a
+crash part way through a save leaves the previous snapshot in place. load() returns None
+for anything it does not recognise, in which case the node just starts from scratch.
+"""
+
+import os
+import struct
+import zlib
+
+MAGIC       = "GVNS"
+VERSION     = 2
+SCREENS     = ("m1", "m2", "m3", "m4", "initial", "search", "connecting", "commsProblem")
+FONTS       = ("small", "medium", "large")
+
+HEADER      = struct.Struct(">4sBIHHIBI")
+HEADER_V1   = struct.Struct(">4sBIHHIB")
+SCREEN      = struct.Struct(">BB")
+LINE        = struct.Struct(">B")
+CRC         = struct.Struct(">I")
+
+def pack(state):
+    """ state is a dict as returned by unpack(). Returns the snapshot as a string. """
+    parts = [HEADER.pack(MAGIC, VERSION, state["nodeID"], state["nodeAddress"], state["bridgeAddress"],
+                         state["t_sleep"], state["revertMessage"], state["configVersion"])]
+    for screen in SCREENS:
+        parts.append(SCREEN.pack(FONTS.index(state["fonts"][screen]), state["numberLines"][screen]))
+        for line in state["messages"][screen]:
+            line = line[:0xFF]
+            parts.append(LINE.pack(len(line)) + line)
+    data = "".join(parts)
+    return data + CRC.pack(zlib.crc32(data) & 0xFFFFFFFF)
+
+def unpack(data):
+    """ Returns the state in a snapshot, or None if it is not a valid snapshot of a version we can read. """
+    if len(data) < HEADER.size + CRC.size or data[:4] != MAGIC:
+        return None
+    if CRC.unpack_from(data, len(data) - CRC.size)[0] != zlib.crc32(data[:-CRC.size]) & 0xFFFFFFFF:
+        return None
+    version = ord(data[4])
+    if version == VERSION:
+        header = HEADER
+        magic, version, nodeID, nodeAddress, bridgeAddress, tSleep, revertMessage, configVersion = \
+            HEADER.unpack_from(data, 0)
+    elif version == 1:
+        header = HEADER_V1
+        magic, version, nodeID, nodeAddress, bridgeAddress, tSleep, revertMessage = HEADER_V1.unpack_from(data, 0)
+        configVersion = 0
+    else:
+        return None
+    state = {
+        "nodeID": nodeID,
+        "nodeAddress": nodeAddress,
+        "bridgeAddress": bridgeAddress,
+        "t_sleep": tSleep,
+        "revertMessage": revertMessage,
+        "configVersion": configVersion,
+        "messages": {},
+        "fonts": {},
+        "numberLines": {}
+    }
+    offset = header.size
+    for screen in SCREENS:
+        font, numberLines = SCREEN.unpack_from(data, offset)
+        offset += SCREEN.size
+        lines = []
+        for l in range(3):
+            length = LINE.unpack_from(data, offset)[0]
+            offset += LINE.size
+            lines.append(data[offset:offset+length])
+            offset += length
+        state["fonts"][screen] = FONTS[font]
+        state["numberLines"][screen] = numberLines
+        state["messages"][screen] = lines
+    return state
+
+def save(path, state):
+    """ Writes a snapshot of state to path atomically. """
+    temp = path + ".tmp"
+    with open(temp, "wb") as f:
+        f.write(pack(state))
+        f.flush()
+        os.fsync(f.fileno())
+    os.rename(temp, path)
+
+def load(path):
+    """ Returns the state saved at path, or None if there is no valid snapshot there. """
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except (IOError, OSError):
+        return None
+    try:
+        return unpack(data)
+    except (struct.error, IndexError):
+        return None
@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+# galvanize_timers.py
+"""
+Copyright (c) 2015 ContinuumBridge Limited
+
+Timer services
+--------------
+
+Galvanize does not call driver.callLater itself. It asks its NodeTimers object, which
+keeps named timer slots ("search", "wakeup", "revert", ...) on top of a timer service.
+Starting a named timer that is already running replaces it, so there is no need to
+cancel first, and cancelling one that is not running does nothing.
+
+There are two timer services with the same interface:
+
+ReactorTimerService     One driver.callLater per timer. This is the default and is fine
+                        for a single node.
+TimerWheel              A hierarchical hashed timer wheel. Schedule, cancel and
+                        reschedule are O(1) and the driver only ever holds one call for
+                        the whole wheel, however many timers and nodes share it. Timers
+                        fire on resolution boundaries.
+
+Both take a driver from galvanize_drivers, or anything else with seconds() and callLater().
+"""
+
+class ReactorTimerService():
+    def __init__(self, driver):
+        self.driver = driver
+
+    def schedule(self, delay, func, *args):
+        return self.driver.callLater(delay, func, *args)
+
+    def reschedule(self, timer, delay, func, *args):
+        if timer.active():
+            timer.cancel()
+        return self.driver.callLater(delay, func, *args)
+
+class Timer():
+    """ A timer in a TimerWheel. Has the parts of the DelayedCall interface that are used. """
+    def __init__(self, expires, seq, func, args):
+        self.expires = expires
+        self.seq = seq
+        self.func = func
+        self.args = args
+        self.bucket = None
+        self.cancelled = 0
+
+    def active(self):
+        return self.bucket is not None
+
+    def cancel(self):
+        if self.bucket is not None:
+            self.bucket.wheel.remove(self)
+        self.cancelled = 1
+
+class Bucket(set):
+    def __init__(self, wheel):
+        set.__init__(self)
+        self.wheel = wheel
+
+class TimerWheel():
+    def __init__(self, driver, resolution=0.001, bits=8, levels=4):
+        self.driver = driver
+        self.resolution = resolution
+        self.bits = bits
+        self.size = 1 << bits
+        self.mask = self.size - 1
+        self.levels = levels
+        self.wheels = [[Bucket(self) for i in range(self.size)] for l in range(levels)]
+        self.overflow = Bucket(self)
+        self.tick = int(driver.seconds() / resolution)
+        self.count = 0
+        self.seq = 0
+        self.driverCall = None
+        self.driverTick = None
+
+    def schedule(self, delay, func, *args):
+        now = self.driver.seconds()
+        if not self.count:
+            # Nothing has moved the tick on while the wheel was empty. Catch up, so that advance
+            # does not have to step through all the time since
+            self.tick = max(self.tick, int(now / self.resolution + 0.5))
+        expires = int((now + delay) / self.resolution + 0.5)
+        self.seq += 1
+        timer = Timer(max(expires, self.tick + 1), self.seq, func, args)
+        self.insert(timer)
+        self.count += 1
+        self.wake(timer.expires)
+        return timer
+
+    def reschedule(self, timer, delay, func, *args):
+        timer.cancel()
+        return self.schedule(delay, func, *args)
+
+    def insert(self, timer):
+        delta = timer.expires - self.tick
+        for level in range(self.levels):
+            if delta < 1 << (self.bits * (level + 1)):
+                bucket = self.wheels[level][(timer.expires >> (self.bits * level)) & self.mask]
+                break
+        else:
+            bucket = self.overflow
+        bucket.add(timer)
+        timer.bucket = bucket
+
+    def remove(self, timer):
+        timer.bucket.remove(timer)
+        timer.bucket = None
+        self.count -= 1
+
+    def step(self):
+        """ Advances the wheel by one tick, cascading higher levels down and firing due timers. """
+        self.tick += 1
+        tick = self.tick
+        for level in range(1, self.levels + 1):
+            if tick & ((1 << (self.bits * level)) - 1):
+                break
+            if level == self.levels:
+                bucket = self.overflow
+                self.overflow = Bucket(self)
+            else:
+                index = (tick >> (self.bits * level)) & self.mask
+                bucket = self.wheels[level][index]
+                self.wheels[level][index] = Bucket(self)
+            for timer in bucket:
+                self.insert(timer)
+        index = tick & self.mask
+        bucket = self.wheels[0][index]
+        if bucket:
+            self.wheels[0][index] = Bucket(self)
+            for timer in bucket:
+                timer.bucket = None
+                self.count -= 1
+            for timer in sorted(bucket, key=lambda t: t.seq):
+                if not timer.cancelled:
+                    timer.func(*timer.args)
+
+    def nextTick(self):
+        """ The next tick at which step() has anything to do: a due bucket or a cascade. """
+        level0 = self.wheels[0]
+        for t in range(self.tick + 1, self.tick + self.size + 1):
+            if level0[t & self.mask] or not t & self.mask:
+                return t
+
+    def advance(self, now):
+        target = int(now / self.resolution + 0.5)
+        while self.tick < target:
+            if not self.count:
+                self.tick = target
+                break
+            t = self.nextTick()
+            if t > target:
+                self.tick = target
+                break
+            self.tick = t - 1
+            self.step()
+
+    def wake(self, tick):
+        """ Makes sure the driver call runs by tick. """
+        if self.driverTick is not None and self.driverTick <= tick:
+            return
+        if self.driverCall is not None and self.driverCall.active():
+            self.driverCall.cancel()
+        self.driverTick = tick
+        self.driverCall = self.driver.callLater(max(0, tick * self.resolution - self.driver.seconds()), self.drive)
+
+    def drive(self):
+        self.driverCall = None
+        self.driverTick = None
+        self.advance(self.driver.seconds())
+        if self.count:
+            self.wake(self.nextTick())
+
+class NodeTimers(object):
+    """ Named timer slots for one node, on a shared timer service. """
+    __slots__ = ("service", "timers")
+
+    def __init__(self, service):
+        self.service = service
+        self.timers = {}
+
+    def start(self, name, delay, func, *args):
+        timer = self.timers.get(name)
+        if timer is None:
+            self.timers[name] = self.service.schedule(delay, func, *args)
+        else:
+            self.timers[name] = self.service.reschedule(timer, delay, func, *args)
+
+    def cancel(self, name):
+        timer = self.timers.pop(name, None)
+        if timer is not None and timer.active():
+            timer.cancel()
+
+    def active(self, name):
+        timer = self.timers.get(name)
+        return timer is not None and timer.active()
+
+    def cancelAll(self):
+        for name in list(self.timers):
+            self.cancel(name)
+
+    def callLater(self, delay, func, *args):
+        """ An anonymous timer. Returns a handle with cancel() and active(). """
+        return self.service.schedule(delay, func, *args)
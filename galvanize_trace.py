@@ -0,0 +1,233 @@
+#!/usr/bin/env python
+# galvanize_trace.py
+"""
+Copyright (c) 2015 ContinuumBridge Limited
+
+Radio traces
+------------
+
+A node with a TraceWriter (see Galvanize.startTrace) records everything it is given and
+everything it sends, so that what happened at a site can be replayed exactly:
+
+    START       the node started tracing. data: nodeID (4) | flags (1), see FLAGS
+    RX          a frame passed to onRadioMessage. data: the frame
+    TX          a frame sent to the radio adaptor. data: the frame
+    BUTTON      onButtonPress. data: buttonState (1) | timeStamp (8)
+    RESTORE     the node was restored from a snapshot. data: the snapshot, see galvanize_state
+
+The trace file is append-only: a header, magic "GVNT" | version (1 byte), followed by
+records of time (8 byte double) | kind (1) | length (2) | data, all big-endian. Each
+restart of the node appends a new START. Records are buffered, and written out after each
+TX and BUTTON record, at each metrics export and when the App shuts down, so a crash can
+lose the last few beacons and leave a partial record at the end, which TraceReader ignores.
+
+TraceReader reads a trace through mmap. replay() feeds a trace back through a fresh
+Galvanize for each START on a VirtualClock, as fast as it will go, and compares the
+frames the node sends with the TX records:
+
+    python galvanize_trace.py [--profile] trace
+"""
+
+import os
+import sys
+import mmap
+import time
+import struct
+import galvanize_state
+from galvanize_core import Galvanize
+from galvanize_drivers import VirtualClock
+
+MAGIC       = "GVNT"
+VERSION     = 1
+HEADER      = struct.Struct(">4sB")
+RECORD      = struct.Struct(">dBH")
+START_DATA  = struct.Struct(">IB")
+BUTTON_DATA = struct.Struct(">Bd")
+
+START       = 0
+RX          = 1
+TX          = 2
+BUTTON      = 3
+RESTORE     = 4
+
+SLOTTED     = 0x01
+AGGREGATE   = 0x02
+MATCH_GRANT = 0x04
+ADAPTIVE    = 0x08
+
+# The node's options, as (flag, attribute), that change what it sends
+FLAGS = (
+    (SLOTTED, "slotted"),
+    (AGGREGATE, "aggregate"),
+    (MATCH_GRANT, "matchGrant"),
+    (ADAPTIVE, "adaptive")
+)
+
+class TraceWriter():
+    def __init__(self, path, buffering=65536):
+        self.path = path
+        self.file = open(path, "ab", buffering)
+        if self.file.tell() == 0:
+            self.file.write(HEADER.pack(MAGIC, VERSION))
+
+    def record(self, now, kind, data):
+        if isinstance(data, memoryview):
+            data = data.tobytes()
+        self.file.write(RECORD.pack(now, kind, len(data)))
+        self.file.write(data)
+
+    def start(self, now, node):
+        flags = 0
+        for flag, name in FLAGS:
+            if getattr(node, name):
+                flags |= flag
+        self.record(now, START, START_DATA.pack(node.nodeID, flags))
+
+    def rx(self, now, frame):
+        self.record(now, RX, frame)
+
+    def tx(self, now, frame):
+        # Flushed on each frame sent and button press, which are rare next to the beacons heard
+        self.record(now, TX, frame)
+        self.file.flush()
+
+    def button(self, now, buttonState, timeStamp):
+        self.record(now, BUTTON, BUTTON_DATA.pack(buttonState, timeStamp))
+        self.file.flush()
+
+    def restore(self, now, snapshot):
+        self.record(now, RESTORE, snapshot)
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+class TraceReader():
+    """ Iterating over a TraceReader gives (time, kind, data) for each complete record. """
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self.size = os.fstat(f.fileno()).st_size
+            if self.size < HEADER.size:
+                raise ValueError("%s is not a trace" % path)
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC or version != VERSION:
+            self.map.close()
+            raise ValueError("%s is not a version %d trace" % (path, VERSION))
+
+    def __iter__(self):
+        traceMap = self.map
+        size = self.size
+        offset = HEADER.size
+        while offset + RECORD.size <= size:
+            now, kind, length = RECORD.unpack_from(traceMap, offset)
+            offset += RECORD.size
+            if offset + length > size:
+                return
+            yield now, kind, traceMap[offset:offset+length]
+            offset += length
+
+    def close(self):
+        self.map.close()
+
+class ReplayTransport():
+    def __init__(self):
+        self.frames = []
+
+    def cbLog(self, level, msg):
+        pass
+
+    def sendMessage(self, msg, destination):
+        self.frames.append(msg["frame"])
+
+    def sendManagerMessage(self, msg):
+        pass
+
+def replayNode(clock, nodeID, flags):
+    transport = ReplayTransport()
+    node = Galvanize(clock, transport=transport)
+    node.id = "replay"
+    node.lprsID = "replay"
+    node.binary = True
+    node.nodeID = nodeID
+    for flag, name in FLAGS:
+        setattr(node, name, bool(flags & flag))
+    node.setLogLevel("warning")
+    return node, transport
+
+def compare(results, recorded, transport):
+    replayed = transport.frames
+    results["tx_replayed"] += len(replayed)
+    results["tx_differing"] += sum(1 for a, b in zip(recorded, replayed) if a != b) + abs(len(recorded) - len(replayed))
+
+def replay(path):
+    """
+    Replays the trace at path and returns a dict of counts. tx_differing counts the TX
+    records that the replay did not send, in the same order, plus any extra frames it sent.
+    Frames the node sends after random waits can come out in a different order.
+    """
+    results = {"sessions": 0, "rx": 0, "button": 0, "tx_recorded": 0, "tx_replayed": 0, "tx_differing": 0,
+               "virtual_time": 0.0, "wall": 0.0}
+    reader = TraceReader(path)
+    start = time.time()
+    clock = None
+    node = None
+    sessionStart = 0.0
+    recorded = []
+    transport = None
+    try:
+        for now, kind, data in reader:
+            if kind == START:
+                if node is not None:
+                    clock.run(now)
+                    compare(results, recorded, transport)
+                    results["virtual_time"] += clock.seconds() - sessionStart
+                clock = VirtualClock(now)
+                sessionStart = now
+                node, transport = replayNode(clock, *START_DATA.unpack(data))
+                recorded = []
+                results["sessions"] += 1
+                continue
+            if node is None:
+                continue
+            clock.run(now)
+            if kind == RX:
+                results["rx"] += 1
+                node.onRadioMessage(data)
+            elif kind == BUTTON:
+                results["button"] += 1
+                node.onButtonPress(*BUTTON_DATA.unpack(data))
+            elif kind == TX:
+                results["tx_recorded"] += 1
+                recorded.append(data)
+            elif kind == RESTORE:
+                node.restoreState(galvanize_state.unpack(data))
+        if node is not None:
+            compare(results, recorded, transport)
+            results["virtual_time"] += clock.seconds() - sessionStart
+    finally:
+        reader.close()
+    results["wall"] = time.time() - start
+    return results
+
+def main(argv):
+    args = [a for a in argv[1:] if a != "--profile"]
+    if len(args) != 1:
+        print("usage: galvanize_trace.py [--profile] trace")
+        return 1
+    if "--profile" in argv:
+        import cProfile
+        import pstats
+        profile = cProfile.Profile()
+        results = profile.runcall(replay, args[0])
+        pstats.Stats(profile).sort_stats("cumulative").print_stats(20)
+    else:
+        results = replay(args[0])
+    for name in ("sessions", "rx", "button", "tx_recorded", "tx_replayed", "tx_differing", "virtual_time", "wall"):
+        print("%-14s %s" % (name, results[name]))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
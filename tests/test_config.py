@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# test_config.py
+"""
+Copyright (c) 2015 ContinuumBridge Limited
+
+Tests of galvanize_config and Galvanize.onConfigSet.
+
+    python -m unittest discover tests
+"""
+
+import os
+import sys
+import unittest
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import galvanize_config
+from galvanize_core import Galvanize, DISPLAY_MESSAGES
+from galvanize_drivers import VirtualClock
+from galvanize_host import Outbox
+
+BASE = [galvanize_config.line(1, 1, "Press for help"), galvanize_config.font(1, "large", 1),
+        galvanize_config.revert(True)]
+
+class DeltaTest(unittest.TestCase):
+    def test_changed_and_added_items(self):
+        changed = galvanize_config.line(1, 1, "Press for a nurse")
+        added = galvanize_config.line(2, 1, "Help is coming")
+        target = [changed, BASE[1], BASE[2], added]
+        self.assertEqual(galvanize_config.delta(BASE, target), [changed, added])
+
+    def test_unchanged(self):
+        self.assertEqual(galvanize_config.delta(BASE, list(BASE)), [])
+
+    def test_removed_setting_needs_full(self):
+        self.assertRaises(ValueError, galvanize_config.delta, BASE, BASE[1:])
+
+class ConfigSetTest(unittest.TestCase):
+    def setUp(self):
+        clock = VirtualClock()
+        self.node = Galvanize(clock, transport=Outbox(clock))
+        self.node.id = "test"
+
+    def configSet(self, items, configVersion, full=True):
+        for payload in galvanize_config.encode(items, configVersion, full):
+            self.node.onConfigSet(memoryview(payload))
+
+    def test_takes_on_version(self):
+        self.configSet(BASE, galvanize_config.version(BASE))
+        self.assertEqual(self.node.configVersion, galvanize_config.version(BASE))
+        self.assertEqual(self.node.displayMessage["m1"][0], "Press for help")
+
+    def test_delta_reaches_target(self):
+        self.configSet(BASE, galvanize_config.version(BASE))
+        target = [galvanize_config.line(1, 1, "Press for a nurse")] + BASE[1:]
+        self.configSet(galvanize_config.delta(BASE, target), galvanize_config.version(target), full=False)
+        self.assertEqual(self.node.configVersion, galvanize_config.version(target))
+        self.assertEqual(self.node.displayMessage["m1"][0], "Press for a nurse")
+
+    def test_full_set_removes_settings(self):
+        self.configSet(BASE, galvanize_config.version(BASE))
+        self.configSet(BASE[1:], galvanize_config.version(BASE[1:]))
+        self.assertEqual(self.node.displayMessage["m1"][0], DISPLAY_MESSAGES["m1"][0])
+
+    def test_unrecognised_item_leaves_version_unknown(self):
+        items = BASE + ["\x60\x00"]
+        self.configSet(items, galvanize_config.version(items))
+        self.assertEqual(self.node.configVersion, galvanize_config.UNKNOWN)
+        self.assertEqual(self.node.configPending, None)
+
+if __name__ == '__main__':
+    unittest.main()
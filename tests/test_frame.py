@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# test_frame.py
+"""
+Copyright (c) 2015 ContinuumBridge Limited
+
+Tests of the galvanize_frame codec.
+
+    python -m unittest discover tests
+"""
+
+import os
+import sys
+import struct
+import unittest
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import galvanize_frame
+import galvanize_config
+from galvanize_frame import WAKEUP
+from galvanize_core import Galvanize
+from galvanize_drivers import VirtualClock
+from galvanize_host import Outbox
+
+class DecodeTest(unittest.TestCase):
+    def test_round_trip(self):
+        frame = galvanize_frame.encode(0x0042, 0x1000, "config", WAKEUP.pack(7) + "\x11\x03abc")
+        dest, source, function, length, wakeup, payload = galvanize_frame.decode(frame)
+        self.assertEqual((dest, source, function, length, wakeup), (0x0042, 0x1000, "config", len(frame), 7))
+        self.assertEqual(payload.tobytes(), "\x11\x03abc")
+
+    def test_header_only(self):
+        frame = galvanize_frame.encode(0xBBBB, 0x1000, "beacon")
+        dest, source, function, length, wakeup, payload = galvanize_frame.decode(frame)
+        self.assertEqual((function, length, wakeup, len(payload)), ("beacon", 6, 0, 0))
+
+    def test_wakeup_without_payload(self):
+        frame = galvanize_frame.encode(0x0042, 0x1000, "ack", WAKEUP.pack(30))
+        dest, source, function, length, wakeup, payload = galvanize_frame.decode(frame)
+        self.assertEqual((wakeup, len(payload)), (30, 0))
+
+    def test_trailing_bytes_are_not_payload(self):
+        frame = galvanize_frame.encode(0x0042, 0x1000, "config", WAKEUP.pack(0) + "\x11\x01a")
+        payload = galvanize_frame.decode(frame + "\x00\xff")[5]
+        self.assertEqual(payload.tobytes(), "\x11\x01a")
+
+    def test_truncated_frame(self):
+        frame = galvanize_frame.encode(0x0042, 0x1000, "config", WAKEUP.pack(0) + "\x11\x03abc")
+        self.assertEqual(galvanize_frame.decode(frame[:-2])[5].tobytes(), "\x11\x03a")
+        self.assertRaises(struct.error, galvanize_frame.decode, frame[:4])
+
+    def test_unknown_function(self):
+        frame = struct.pack(">HHBB", 0x0042, 0x1000, 0x7F, 6)
+        self.assertEqual(galvanize_frame.decode(frame)[2], None)
+
+class UplinkTest(unittest.TestCase):
+    def test_round_trip(self):
+        frame = galvanize_frame.encode(0x1000, 0x0042, "alert", "\x00\x01")
+        dest, source, function, length, payload = galvanize_frame.decode_uplink(frame + "\x00")
+        self.assertEqual((dest, source, function, length), (0x1000, 0x0042, "alert", 8))
+        self.assertEqual(payload.tobytes(), "\x00\x01")
+
+    def test_aggregate_round_trip(self):
+        records = [("alert", "\x00\x01"), ("woken_up", None), ("send_battery", "\x00\x64")]
+        frame = galvanize_frame.encode_aggregate(0x1000, 0x0042, records)
+        function, length, payload = galvanize_frame.decode_uplink(frame)[2:]
+        self.assertEqual(function, "aggregate")
+        decoded = [(name, data.tobytes()) for name, data in galvanize_frame.decode_records(payload)]
+        self.assertEqual(decoded, [(name, data or "") for name, data in records])
+
+class ReceiveTest(unittest.TestCase):
+    def test_config_set_with_trailing_byte(self):
+        clock = VirtualClock()
+        node = Galvanize(clock, transport=Outbox(clock))
+        node.id = "test"
+        node.radioOn = True
+        node.nodeAddress = 0x0042
+        node.bridgeAddress = 0x1000
+        items = [galvanize_config.line(1, 1, "Press for help")]
+        payload = galvanize_config.encode(items, galvanize_config.version(items))[0]
+        frame = galvanize_frame.encode(0x0042, 0x1000, "config_set", WAKEUP.pack(0) + payload)
+        node.onRadioMessage(frame + "\x00")
+        self.assertEqual(node.configVersion, galvanize_config.version(items))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+# test_machine.py
+"""
+Copyright (c) 2015 ContinuumBridge Limited
+
+Tests of the node state machine, galvanize_core.TRANSITIONS, driven through Galvanize.
+
+    python -m unittest discover tests
+"""
+
+import os
+import sys
+import unittest
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from galvanize_core import Galvanize, MACHINE, INITIAL, SEARCH
+from galvanize_drivers import VirtualClock
+from galvanize_host import Outbox
+
+class MachineTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = VirtualClock()
+        self.node = Galvanize(self.clock, transport=Outbox(self.clock))
+        self.node.id = "test"
+
+    def press(self, seconds):
+        self.node.onButtonPress(1, 0)
+        self.node.onButtonPress(0, seconds)
+
+    def test_valid(self):
+        self.assertEqual(MACHINE.validate(Galvanize), [])
+
+    def test_start_press_measured_against_t_start_press(self):
+        self.node.setInterval("t_start_press", 5)
+        self.press(4)       # Long, but not long enough to start
+        self.assertEqual(self.node.nodeState, INITIAL)
+        self.press(6)
+        self.assertEqual(self.node.nodeState, SEARCH)
+
+    def test_short_start_press(self):
+        self.node.setInterval("t_start_press", 1)
+        self.press(2)       # Shorter than t_long_press, which does not matter before the node is started
+        self.assertEqual(self.node.nodeState, SEARCH)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+# test_send.py
+"""
+Copyright (c) 2015 ContinuumBridge Limited
+
+Tests of galvanize_send.SendQueue and of Galvanize.manageSend following RETRY_POLICIES.
+
+    python -m unittest discover tests
+"""
+
+import os
+import sys
+import random
+import unittest
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import galvanize_send
+from galvanize_send import SendQueue, RANDOM, IDLE, GIVE_UP_DROP, DEFAULT_RETRY_POLICY
+import galvanize_frame
+from galvanize_core import Galvanize, SLOT_TIME, MAX_SLOTS, TDMA_SLOTS, BEACON_ADDRESS, INCLUDE_REQ, SEARCH
+from galvanize_drivers import VirtualClock
+from galvanize_host import Outbox
+
+def entry(function, tag=None):
+    return {"function": function, "attempt": 0, "tag": tag}
+
+class SendQueueTest(unittest.TestCase):
+    def test_priority_order(self):
+        queue = SendQueue()
+        for function in ("battery_status", "alert", "woken_up", "ack", "include_req"):
+            queue.push(entry(function))
+        self.assertEqual(len(queue), 5)
+        self.assertEqual([e["function"] for e in queue],
+                         ["ack", "include_req", "alert", "battery_status", "woken_up"])
+        self.assertEqual([queue.pop()["function"] for n in range(5)],
+                         ["ack", "include_req", "alert", "battery_status", "woken_up"])
+        self.assertEqual(queue.head(), None)
+        self.assertRaises(IndexError, queue.pop)
+
+    def test_same_priority_is_first_in_first_out(self):
+        queue = SendQueue()
+        for n in range(3):
+            queue.push(entry("alert", n))
+        self.assertEqual([queue.pop()["tag"] for n in range(3)], [0, 1, 2])
+
+    def test_discard_removes_that_entry(self):
+        queue = SendQueue()
+        first, second = entry("alert"), entry("alert")
+        queue.push(first)
+        queue.push(second)
+        queue.discard(second)
+        self.assertTrue(queue.head() is first)
+        self.assertFalse(second["queued"])
+        self.assertEqual(len(queue), 1)
+        queue.discard(second)       # No longer queued, so nothing happens
+        self.assertEqual(len(queue), 1)
+        queue.discard(first)
+        self.assertEqual((len(queue), queue.head()), (0, None))
+
+    def test_clear(self):
+        queue = SendQueue()
+        entries = [entry("alert"), entry("ack")]
+        for e in entries:
+            queue.push(e)
+        queue.clear()
+        self.assertEqual(len(queue), 0)
+        self.assertEqual([e["queued"] for e in entries], [False, False])
+
+class ManageSendTest(unittest.TestCase):
+    def setUp(self):
+        random.seed(1)
+        self.clock = VirtualClock()
+        self.outbox = Outbox(self.clock)
+        self.node = Galvanize(self.clock, transport=self.outbox)
+        self.node.id = "test"
+        self.node.bridgeAddress = 0x1000
+        self.node.nodeAddress = 0x0042
+
+    def send(self, function, data=None, policy=None):
+        self.node.sendRadio(function, data, policy)
+        self.node.timers.cancel("search")     # Beacons are delivered by hand, so nothing is heard
+
+    def beacons(self, count):
+        """ Calls manageSend as each beacon would, a beacon period apart. """
+        for n in range(count):
+            self.node.manageSend()
+            self.clock.run(self.clock.now + 3)
+
+    def test_gives_up_after_the_last_attempt(self):
+        self.send("alert", "\x00\x00")
+        attempts = DEFAULT_RETRY_POLICY["attempts"]
+        self.beacons(len(attempts))
+        self.assertEqual(len(self.node.radioQueue), 1)
+        self.assertEqual(len(self.outbox.frames), len([a for a in attempts if a != IDLE]))
+        self.beacons(1)
+        self.assertEqual(len(self.node.radioQueue), 0)
+        self.assertEqual(self.node.radioCounters["given_up"], 1)
+        self.assertEqual(self.node.radioCounters["comms_problem"], 1)
+        self.assertEqual(self.node.metrics.snapshot(self.clock.now)["give_up_attempts"],
+                         {"alert": [0] * len(attempts) + [1]})
+
+    def test_attempts_until_acked(self):
+        self.send("alert", "\x00\x00")
+        self.beacons(2)
+        self.node.acknowledged()
+        self.assertEqual(len(self.node.radioQueue), 0)
+        self.assertEqual(self.node.metrics.snapshot(self.clock.now)["ack_attempts"], {"alert": [0, 0, 1]})
+
+    def test_give_up_drop_keeps_the_rest(self):
+        self.node.retryPolicies = dict(galvanize_send.RETRY_POLICIES)
+        self.node.retryPolicies["alert"] = {"attempts": (RANDOM,), "give_up": GIVE_UP_DROP, "once": False}
+        self.send("alert", "\x00\x00")
+        self.send("woken_up", "\x00\x00\x00\x00")
+        self.beacons(2)
+        self.assertEqual([e["function"] for e in self.node.radioQueue], ["woken_up"])
+        self.assertEqual(self.node.radioCounters["dropped"], 1)
+        self.assertEqual(self.node.radioCounters["comms_problem"], 0)
+
+    def test_once_is_removed_when_sent(self):
+        self.send("ack")
+        self.beacons(1)
+        self.assertEqual(len(self.outbox.frames), 1)
+        self.assertEqual(len(self.node.radioQueue), 0)
+
+    def test_random_within_the_frame(self):
+        for slotted, earliest in ((False, 0), (True, TDMA_SLOTS * SLOT_TIME)):
+            self.node.slotted = slotted
+            for n in range(50):
+                self.outbox.frames = []
+                self.send("include_req", "\x00\x00\x00\x00", "include_retry")
+                start = self.clock.now
+                self.beacons(1)
+                sentAt = self.outbox.frames[0][0] - start
+                self.node.radioQueue.clear()
+                self.assertTrue(earliest / 1000.0 <= sentAt <= MAX_SLOTS * SLOT_TIME / 1000.0, (slotted, sentAt))
+
+class InclusionTest(unittest.TestCase):
+    def test_retries_then_searches(self):
+        random.seed(1)
+        clock = VirtualClock()
+        outbox = Outbox(clock)
+        node = Galvanize(clock, transport=outbox)
+        node.id = "test"
+        node.onButtonPress(1, 0)
+        node.onButtonPress(0, node.intervals["t_start_press"] + 1)
+        beacon = galvanize_frame.encode(BEACON_ADDRESS, 0x1000, "beacon")
+        retry = galvanize_send.RETRY_POLICIES["include_retry"]["attempts"]
+        sentOn = []
+        # include_req is queued on the first beacon and sent after the second. include_retry
+        # is queued on the third, and given up on the beacon after its last attempt
+        for n in range(len(retry) + 4):
+            before = len(outbox.frames)
+            node.onRadioMessage(beacon)
+            clock.run(clock.now + 3)
+            if len(outbox.frames) > before:
+                sentOn.append(n)
+            if n < len(retry) + 3:
+                self.assertEqual(node.nodeState, INCLUDE_REQ)
+        self.assertEqual(sentOn, [1] + [n + 3 for n, action in enumerate(retry) if action == RANDOM])
+        self.assertEqual(node.nodeState, SEARCH)
+        self.assertFalse(node.radioOn)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+# test_state.py
+"""
+Copyright (c) 2015 ContinuumBridge Limited
+
+Tests of galvanize_state snapshots, and of saving and restoring them in Galvanize.
+
+    python -m unittest discover tests
+"""
+
+import os
+import sys
+import zlib
+import shutil
+import struct
+import tempfile
+import unittest
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import galvanize_frame
+import galvanize_state
+import galvanize_config
+from galvanize_frame import WAKEUP
+from galvanize_core import Galvanize, BEACON_ADDRESS, GRANT_ADDRESS, INITIAL, NORMAL
+from galvanize_drivers import VirtualClock
+from galvanize_host import Outbox
+
+NODE_ID         = 1234
+NODE_ADDRESS    = 0x0042
+BRIDGE_ADDRESS  = 0x1000
+
+def makeState():
+    state = {
+        "nodeID": NODE_ID,
+        "nodeAddress": NODE_ADDRESS,
+        "bridgeAddress": BRIDGE_ADDRESS,
+        "t_sleep": 120,
+        "revertMessage": 1,
+        "configVersion": 0x12345678,
+        "messages": {},
+        "fonts": {},
+        "numberLines": {}
+    }
+    for n, screen in enumerate(galvanize_state.SCREENS):
+        state["messages"][screen] = ["%s line %d" % (screen, l) for l in range(3)]
+        state["fonts"][screen] = galvanize_state.FONTS[n % 3]
+        state["numberLines"][screen] = n % 3 + 1
+    return state
+
+def packV1(state):
+    """ A version 1 snapshot, which had no configVersion. """
+    parts = [galvanize_state.HEADER_V1.pack(galvanize_state.MAGIC, 1, state["nodeID"], state["nodeAddress"],
+                                            state["bridgeAddress"], state["t_sleep"], state["revertMessage"])]
+    for screen in galvanize_state.SCREENS:
+        parts.append(galvanize_state.SCREEN.pack(galvanize_state.FONTS.index(state["fonts"][screen]),
+                                                 state["numberLines"][screen]))
+        for line in state["messages"][screen]:
+            parts.append(chr(len(line)) + line)
+    data = "".join(parts)
+    return data + galvanize_state.CRC.pack(zlib.crc32(data) & 0xFFFFFFFF)
+
+class SnapshotTest(unittest.TestCase):
+    def test_round_trip(self):
+        state = makeState()
+        self.assertEqual(galvanize_state.unpack(galvanize_state.pack(state)), state)
+
+    def test_corrupted_crc(self):
+        data = galvanize_state.pack(makeState())
+        self.assertEqual(galvanize_state.unpack(data[:-1] + chr(ord(data[-1]) ^ 1)), None)
+        self.assertEqual(galvanize_state.unpack(data[:20] + "x" + data[21:]), None)
+
+    def test_version_1(self):
+        state = makeState()
+        state["configVersion"] = galvanize_config.UNKNOWN
+        self.assertEqual(galvanize_state.unpack(packV1(state)), state)
+
+    def test_unknown_version(self):
+        data = galvanize_state.pack(makeState())
+        data = data[:4] + chr(9) + data[5:-4]
+        self.assertEqual(galvanize_state.unpack(data + galvanize_state.CRC.pack(zlib.crc32(data) & 0xFFFFFFFF)), None)
+
+class NodeStateTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "node.state")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def start(self):
+        """ A node as the app starts it: restored from its snapshot if it has one. """
+        clock = VirtualClock()
+        node = Galvanize(clock, transport=Outbox(clock))
+        node.id = "test"
+        node.nodeID = NODE_ID
+        node.statePath = self.path
+        node.restoreState()
+        return node
+
+    def press(self, node, seconds):
+        now = node.driver.seconds()
+        node.onButtonPress(1, now)
+        node.onButtonPress(0, now + seconds)
+
+    def include(self, node):
+        self.press(node, node.intervals["t_start_press"] + 1)
+        node.onRadioMessage(galvanize_frame.encode(BEACON_ADDRESS, BRIDGE_ADDRESS, "beacon"))
+        grant = WAKEUP.pack(0) + struct.pack("I", NODE_ID) + struct.pack(">H", NODE_ADDRESS)
+        node.onRadioMessage(galvanize_frame.encode(GRANT_ADDRESS, BRIDGE_ADDRESS, "include_grant", grant))
+
+    def test_restores_included_node(self):
+        node = self.start()
+        self.include(node)
+        self.assertEqual(node.nodeState, NORMAL)
+        node = self.start()
+        self.assertEqual((node.nodeState, node.nodeAddress, node.bridgeAddress),
+                         (NORMAL, NODE_ADDRESS, BRIDGE_ADDRESS))
+
+    def test_corrupted_snapshot_starts_from_scratch(self):
+        self.include(self.start())
+        with open(self.path, "r+b") as f:
+            f.seek(-1, os.SEEK_END)
+            f.write("\x00" if f.read(1) != "\x00" else "\x01")
+        node = self.start()
+        self.assertEqual((node.nodeState, node.nodeAddress), (INITIAL, 0xFFFF))
+
+    def test_reset_sticks(self):
+        node = self.start()
+        self.include(node)
+        self.press(node, node.intervals["t_reset_press"] + 1)
+        self.assertEqual((node.nodeState, node.nodeAddress, node.bridgeAddress), (INITIAL, 0xFFFF, None))
+        node.radioOn = True     # Even if a frame to the old address gets through
+        line = galvanize_config.line(1, 1, "After reset")
+        node.onRadioMessage(galvanize_frame.encode(NODE_ADDRESS, BRIDGE_ADDRESS, "config", WAKEUP.pack(0) + line))
+        node.saveState()
+        self.assertFalse(os.path.exists(self.path))
+        self.assertEqual(self.start().nodeState, INITIAL)
+
+if __name__ == '__main__':
+    unittest.main()
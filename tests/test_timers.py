@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# test_timers.py
+"""
+Copyright (c) 2015 ContinuumBridge Limited
+
+Tests of galvanize_timers.TimerWheel on a VirtualClock.
+
+    python -m unittest discover tests
+"""
+
+import os
+import sys
+import unittest
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from galvanize_drivers import VirtualClock
+from galvanize_timers import TimerWheel, NodeTimers
+
+class TimerWheelTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = VirtualClock()
+        self.wheel = TimerWheel(self.clock)
+        self.fired = []
+
+    def fire(self, name):
+        self.fired.append((name, round(self.clock.seconds(), 3)))
+
+    def test_fires_at_expiry_in_order(self):
+        # Delays that land in each level of the wheel, scheduled out of order
+        for name, delay in (("c", 70.0), ("a", 0.25), ("d", 2000.0), ("b", 0.3)):
+            self.wheel.schedule(delay, self.fire, name)
+        self.clock.run()
+        self.assertEqual(self.fired, [("a", 0.25), ("b", 0.3), ("c", 70.0), ("d", 2000.0)])
+        self.assertEqual(self.wheel.count, 0)
+
+    def test_same_tick_fires_in_schedule_order(self):
+        for name in "xyz":
+            self.wheel.schedule(1.0, self.fire, name)
+        self.clock.run()
+        self.assertEqual([name for name, t in self.fired], ["x", "y", "z"])
+
+    def test_cancel_and_reschedule(self):
+        cancelled = self.wheel.schedule(1.0, self.fire, "cancelled")
+        moved = self.wheel.schedule(1.0, self.fire, "moved")
+        cancelled.cancel()
+        self.assertFalse(cancelled.active())
+        moved = self.wheel.reschedule(moved, 5.0, self.fire, "moved")
+        self.assertTrue(moved.active())
+        self.clock.run()
+        self.assertEqual(self.fired, [("moved", 5.0)])
+
+    def test_timer_cancelled_by_earlier_timer_in_same_tick(self):
+        later = []
+        self.wheel.schedule(1.0, lambda: later[0].cancel())
+        later.append(self.wheel.schedule(1.0, self.fire, "later"))
+        self.clock.run()
+        self.assertEqual(self.fired, [])
+
+    def test_schedule_after_idle_catches_up(self):
+        self.wheel.schedule(1.0, self.fire, "first")
+        self.clock.run()
+        self.clock.advance(86400.0)     # A day with nothing scheduled
+        self.wheel.schedule(1.0, self.fire, "after idle")
+        self.assertEqual(self.wheel.tick, int(self.clock.seconds() / self.wheel.resolution + 0.5))
+        self.clock.run()
+        self.assertEqual(self.fired, [("first", 1.0), ("after idle", 86402.0)])
+
+    def test_node_timers_replace_named_timer(self):
+        timers = NodeTimers(self.wheel)
+        timers.start("search", 30.0, self.fire, "search 30")
+        timers.start("search", 10.0, self.fire, "search 10")
+        self.assertTrue(timers.active("search"))
+        self.clock.run()
+        self.assertEqual(self.fired, [("search 10", 10.0)])
+        self.assertFalse(timers.active("search"))
+
+if __name__ == '__main__':
+    unittest.main()